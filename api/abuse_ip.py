@@ -1,8 +1,46 @@
-import requests
-from typing import Tuple, List, Optional
+import re
+from typing import Any, Dict, Iterable, Tuple, List, Optional
+from helpers.fetch import fetch_raw
+from helpers.raw_cache import iter_raw_chunks
 
-def fetch_abuseip_blacklist(abuseipdb_api_key: str, abuseipdb_url: str,
-                            conf_min: int) -> Tuple[List[str], Optional[str]]:
+# long enough to hold any partial "ipAddress"/"generatedAt" pair cut at a chunk edge
+_TAIL = 256
+
+_IP_RE = re.compile(rb'"ipAddress"\s*:\s*"([^"]+)"')
+_GENERATED_RE = re.compile(rb'"generatedAt"\s*:\s*"([^"]+)"')
+
+
+def scan_blacklist(chunks: Iterable[bytes]) -> Tuple[List[str], Optional[str]]:
+    """
+    Pulls data[].ipAddress and meta.generatedAt out of the raw blacklist
+    payload chunk by chunk, without decoding the JSON into objects.
+    """
+    ips: List[str] = []
+    generated_at: Optional[str] = None
+    buf = b""
+    for chunk in chunks:
+        if not chunk:
+            continue
+        buf += chunk
+        end = 0
+        for m in _IP_RE.finditer(buf):
+            ips.append(m.group(1).decode("ascii", "replace"))
+            end = m.end()
+        if generated_at is None:
+            m = _GENERATED_RE.search(buf)
+            if m:
+                generated_at = m.group(1).decode("ascii", "replace")
+                end = max(end, m.end())
+        buf = buf[max(end, len(buf) - _TAIL):]
+    return ips, generated_at
+
+
+def fetch_abuseip_blacklist(abuseipdb_api_key: str, abuseipdb_url: str, conf_min: int,
+                            state: Optional[Dict[str, Any]] = None) -> Optional[Tuple[List[str], Optional[str]]]:
+    """
+    With state, None means the payload is byte-identical to the last
+    processed one.
+    """
     headers = {
         "Accept": "application/json",
         "Key": abuseipdb_api_key,
@@ -13,18 +51,8 @@ def fetch_abuseip_blacklist(abuseipdb_api_key: str, abuseipdb_url: str,
         "limit": "500000"
     }
 
-    resp = requests.get(abuseipdb_url, headers=headers, params=params, timeout=60)
-    resp.raise_for_status()
-    payload = resp.json()
-
-    # IPs
-    ips: List[str] = []
-    for entry in (payload.get("data") or []):
-        ip = entry.get("ipAddress")
-        if ip:
-            ips.append(ip)
-
-    # meta.generatedAt
-    meta = payload.get("meta") or {}
-    generated_at = meta.get("generatedAt")
-    return ips, generated_at
\ No newline at end of file
+    digest = fetch_raw(abuseipdb_url, state, headers=headers, params=params, timeout=60)
+    if digest is None:
+        return None
+    # IPs and meta.generatedAt
+    return scan_blacklist(iter_raw_chunks(digest))
@@ -1,10 +1,15 @@
 from __future__ import annotations
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterable, Optional
 from api.safeline import _request
 from helpers.classes.rule_extract import extract_rule_fields
 
 RULES_ENDPOINT = "/open/policy"
 
+# Per-run index of the SafeLine policies (name -> rule) and the rule writes
+# queued during the run (name -> requested changes), flushed as one PUT per rule.
+_rules: Dict[str, Dict[str, Any]] | None = None
+_pending: Dict[str, Dict[str, Any]] = {}
+
 
 def list_rules() -> List[Dict[str, Any]]:
     all_rules: List[Dict[str, Any]] = []
@@ -32,11 +37,39 @@ def list_rules() -> List[Dict[str, Any]]:
     return all_rules
 
 
-def get_rule_by_name(name: str) -> Optional[Dict[str, Any]]:
+def _rule_index() -> Dict[str, Dict[str, Any]]:
+    global _rules
+    if _rules is not None:
+        return _rules
+    index: Dict[str, Dict[str, Any]] = {}
     for r in list_rules():
-        if r.get("name") == name:
-            return r
-    return None
+        name = r.get("name")
+        if name:
+            index.setdefault(name, r)
+    _rules = index
+    return index
+
+
+def get_rule_by_name(name: str) -> Optional[Dict[str, Any]]:
+    return _rule_index().get(name)
+
+
+def _ip_group_pattern(group_ids: Iterable[int]) -> List[List[Dict[str, Any]]]:
+    return [[{"k": "src_ip", "op": "in", "v": [str(i) for i in group_ids], "sub_k": ""}]]
+
+
+def _pattern_key(pattern: Any) -> Any:
+    if not isinstance(pattern, list):
+        return pattern
+    key = []
+    for clause in pattern:
+        conds = []
+        for c in clause or []:
+            v = c.get("v")
+            v = sorted(str(x) for x in v) if isinstance(v, list) else v
+            conds.append((c.get("k"), c.get("op"), str(v), c.get("sub_k") or ""))
+        key.append(tuple(conds))
+    return tuple(key)
 
 
 def create_rule_minimal(*, name: str, policy: int, enabled: bool = True,
@@ -48,50 +81,80 @@ def create_rule_minimal(*, name: str, policy: int, enabled: bool = True,
     }
     if ip_group_ids:
         body["ip_group_ids"] = [int(x) for x in ip_group_ids]
-        body["pattern"] = [[{"k": "src_ip", "op": "in", "v": [str(i) for i in ip_group_ids], "sub_k": ""}]]
+        body["pattern"] = _ip_group_pattern(ip_group_ids)
     resp = _request("POST", RULES_ENDPOINT, json=body)
     js = resp.json()
     d = js.get("data")
     if isinstance(d, int):
-        return int(d)
-    if isinstance(d, dict) and isinstance(d.get("id"), int):
-        return int(d["id"])
-    raise RuntimeError(f"Unexpected rule-create response: {js!r}")
+        rid = int(d)
+    elif isinstance(d, dict) and isinstance(d.get("id"), int):
+        rid = int(d["id"])
+    else:
+        raise RuntimeError(f"Unexpected rule-create response: {js!r}")
+    # add the new rule to the index as created, with the defaults of a new
+    # policy, instead of listing /open/policy again
+    _rule_index()[name] = {"auth_source_ids": [], "log": False, "pattern": [], **body, "id": rid}
+    return rid
+
+
+def queue_rule_update(rule_name: str, *, group_ids: Optional[List[int]] = None,
+                      policy: Optional[int] = None, enabled: Optional[bool] = None) -> None:
+    """
+    Record a change for a rule without sending it. Later calls for the same
+    rule override earlier ones field by field; flush_rule_updates() merges
+    everything into at most one PUT per rule.
+    """
+    pending = _pending.setdefault(rule_name, {})
+    if group_ids is not None:
+        pending["pattern"] = _ip_group_pattern(group_ids)
+    if policy is not None:
+        pending["action"] = int(policy)
+    if enabled is not None:
+        pending["is_enabled"] = bool(enabled)
+
+
+def flush_rule_updates(rule_names: Optional[Iterable[str]] = None) -> int:
+    """
+    Send the queued changes (all rules, or only rule_names). A rule whose
+    pattern, action and is_enabled already match is not written.
+    Returns the number of PUT requests sent.
+    """
+    names = list(_pending) if rule_names is None else [n for n in rule_names if n in _pending]
+    sent = 0
+    for name in names:
+        changes = _pending.pop(name)
+        rule = get_rule_by_name(name)
+        if not rule:
+            continue
+        fields = extract_rule_fields(rule)
+        pattern = changes.get("pattern", fields["pattern"])
+        action = changes.get("action", fields["action"])
+        is_enabled = changes.get("is_enabled", fields["is_enabled"])
+        if _pattern_key(pattern) == _pattern_key(fields["pattern"]) \
+                and action == fields["action"] and is_enabled == fields["is_enabled"]:
+            continue
+        body = {
+            "id": fields["id"],
+            "name": fields["name"],
+            "is_enabled": is_enabled,
+            "pattern": pattern,
+            "auth_source_ids": fields["auth_source_ids"],
+            "action": action,
+            "log": fields["log"],
+        }
+        _request("PUT", RULES_ENDPOINT, json=body)
+        rule.update(pattern=pattern, action=action, is_enabled=is_enabled)
+        sent += 1
+    return sent
 
 
-def update_rule_ip_groups(rule: dict[str, Any], group_ids: list[int]) -> None:
-    fields = extract_rule_fields(rule)
-    pattern = [[{"k": "src_ip", "op": "in", "v": [str(i) for i in group_ids], "sub_k": ""}]]
-    body = {
-        "id": fields["id"],
-        "name": fields["name"],
-        "is_enabled": fields["is_enabled"],
-        "pattern": pattern,
-        "auth_source_ids": fields["auth_source_ids"],
-        "action": fields["action"],
-        "log": fields["log"],
-    }
-    _request("PUT", RULES_ENDPOINT, json=body)
-
-
-def update_rule_action(policy: int, rule: dict[str, Any],
-                       rule_enabled: bool) -> None:
-    fields = extract_rule_fields(rule)
-    body = {
-        "id": fields["id"],
-        "name": fields["name"],
-        "is_enabled": rule_enabled,
-        "pattern": fields["pattern"],
-        "auth_source_ids": fields["auth_source_ids"],
-        "action": policy,
-        "log": fields["log"],
-    }
-    _request("PUT", RULES_ENDPOINT, json=body)
-
 def delete_rule(rule_name: str) -> bool:
     rule: Optional[Dict[str, Any]] = get_rule_by_name(rule_name)
+    _pending.pop(rule_name, None)
     if not rule:
         return False
     body = {"id": int(rule["id"])}
     _request("DELETE", RULES_ENDPOINT, json=body)
+    if _rules is not None:
+        _rules.pop(rule_name, None)
     return True
\ No newline at end of file
@@ -1,17 +1,24 @@
 from __future__ import annotations
-from typing import Optional, List
+from typing import Dict, Optional, List, Sequence
+import re
+import threading
+import time
 import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 import urllib3
 
 from config.credentials import settings
+from helpers.pacing import note_request_time
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 BASE = settings.SAFELINE_BASE_URL.rstrip("/")
 VERIFY_SSL = getattr(settings, "SAFELINE_VERIFY_SSL", False)
 DEFAULT_TIMEOUT = float(getattr(settings, "SAFELINE_TIMEOUT", 30))
+# upper bound for requests in flight against the SafeLine host, whatever the
+# number of upload workers
+MAX_CONCURRENCY = max(1, int(settings.SAFELINE_MAX_CONCURRENCY))
 
 HDRS = {
     "X-SLCE-API-TOKEN": settings.SAFELINE_API_TOKEN,
@@ -20,43 +27,135 @@ HDRS = {
 }
 
 _session: requests.Session | None = None
-def _session_with_retries() -> requests.Session:
-    global _session
-    if _session is not None:
+_post_session: requests.Session | None = None
+_session_lock = threading.Lock()
+_host_slots = threading.BoundedSemaphore(MAX_CONCURRENCY)
+
+def _session_with_retries(method: str = "GET") -> requests.Session:
+    global _session, _post_session
+    with _session_lock:
+        if method == "POST":
+            if _post_session is None:
+                _post_session = _new_session(_post_retry())
+            return _post_session
+        if _session is None:
+            _session = _new_session(_retry())
         return _session
-    s = requests.Session()
-    retry = Retry(
+
+
+def _retry() -> Retry:
+    return Retry(
         total=5,
         backoff_factor=0.5,
         status_forcelist=(429, 500, 502, 503, 504),
-        allowed_methods=frozenset(["GET", "POST", "PUT", "DELETE"]),
+        allowed_methods=frozenset(["GET", "PUT", "DELETE"]),
+        raise_on_status=False,
+    )
+
+
+def _post_retry() -> Retry:
+    # POST creates a group or rule, or appends to a group: sent twice after
+    # a lost response it would duplicate it. 429 and 503 are answered before
+    # the request is processed and a refused connection sent nothing, so
+    # only those are retried; a read error or any other status is not.
+    return Retry(
+        total=5,
+        connect=5,
+        read=0,
+        other=0,
+        backoff_factor=0.5,
+        status_forcelist=(429, 503),
+        allowed_methods=frozenset(["POST"]),
         raise_on_status=False,
     )
-    adapter = HTTPAdapter(max_retries=retry)
+
+
+def _new_session(retry: Retry) -> requests.Session:
+    s = requests.Session()
+    adapter = HTTPAdapter(max_retries=retry, pool_maxsize=max(10, MAX_CONCURRENCY))
     s.mount("http://", adapter)
     s.mount("https://", adapter)
-    _session = s
     return s
 
 
 def _request(method: str, path: str, **kwargs) -> requests.Response:
-    s = _session_with_retries()
+    s = _session_with_retries(method)
     url = f"{BASE}{path}"
     kwargs.setdefault("headers", HDRS)
     kwargs.setdefault("verify", VERIFY_SSL)
     kwargs.setdefault("timeout", DEFAULT_TIMEOUT)
-    resp = s.request(method=method, url=url, **kwargs)
+    with _host_slots:
+        t0 = time.monotonic()
+        resp = s.request(method=method, url=url, **kwargs)
+        note_request_time(time.monotonic() - t0)
     resp.raise_for_status()
     return resp
 
 
+# Per-run index of the SafeLine IP groups (comment -> id). The full listing is
+# fetched once and kept in sync by create_ip_group / delete_ip_group.
+# _group_ips keeps the contents of groups whose listing node carried them,
+# until the group is written to.
+_groups: Dict[str, int] | None = None
+_group_ips: Dict[int, List[str]] = {}
+_groups_lock = threading.RLock()
+
+
+def _group_index() -> Dict[str, int]:
+    global _groups
+    with _groups_lock:
+        if _groups is not None:
+            return _groups
+        resp = _request("GET", "/open/ipgroup")
+        data = resp.json()
+        index: Dict[str, int] = {}
+        _group_ips.clear()
+        for node in data.get("data", {}).get("nodes", []):
+            comment = node.get("comment")
+            if isinstance(comment, str) and node.get("id") is not None:
+                index.setdefault(comment, int(node["id"]))
+                if isinstance(node.get("ips"), list):
+                    _group_ips[int(node["id"])] = node["ips"]
+        _groups = index
+        return index
+
+
+def refresh_ip_groups() -> None:
+    """
+    Drop the cached group index; the next lookup lists /open/ipgroup again.
+    """
+    global _groups
+    with _groups_lock:
+        _groups = None
+
+
 def get_ip_group_id(group_name: str) -> Optional[int]:
-    resp = _request("GET", "/open/ipgroup")
-    data = resp.json()
-    for node in data.get("data", {}).get("nodes", []):
-        if node.get("comment") == group_name:
-            return int(node["id"])
-    return None
+    return _group_index().get(group_name)
+
+
+def get_ip_group_ips(gid: int) -> Optional[List[str]]:
+    """
+    Contents of a group as listed by /open/ipgroup, if the listing included
+    them and the group has not been written to since.
+    """
+    _group_index()
+    with _groups_lock:
+        return _group_ips.get(gid)
+
+
+def groups_with_prefix(base: str) -> Dict[int, int]:
+    """
+    Returns {index: group id} for every group named '<base>-NNN'.
+    """
+    pattern = re.compile(rf"^{re.escape(base)}-(\d+)$")
+    out: Dict[int, int] = {}
+    with _groups_lock:
+        items = list(_group_index().items())
+    for name, gid in items:
+        m = pattern.match(name)
+        if m:
+            out[int(m.group(1))] = gid
+    return dict(sorted(out.items()))
 
 
 def get_or_create_ip_group(group_name: str, bootstrap_ips: Optional[List[str]] = None) -> int:
@@ -66,57 +165,65 @@ def get_or_create_ip_group(group_name: str, bootstrap_ips: Optional[List[str]] =
     return create_ip_group(group_name, bootstrap_ips or [])
 
 
-def create_ip_group(group_name: str, ips_to_add: List[str]) -> int:
+def create_ip_group(group_name: str, ips_to_add: Sequence[str]) -> int:
     body = {
         "comment": group_name,
-        "ips": ips_to_add or [],
+        "ips": list(ips_to_add or []),
     }
     resp = _request("POST", "/open/ipgroup", json=body)
     data = resp.json()
     new_id = data.get("data")
     if new_id is None:
+        refresh_ip_groups()
         gid = get_ip_group_id(group_name)
         if gid is None:
             raise RuntimeError(f"Group '{group_name}' created but ID not returned and not found.")
         return gid
+    with _groups_lock:
+        if _groups is not None:
+            _groups[group_name] = int(new_id)
     return int(new_id)
 
 
-def update_ip_group(ip_group_name: str, ip_group_id: int, ips_to_set: List[str]) -> None:
-    if ips_to_set is None:
-        ips_to_set = []
+def update_ip_group(ip_group_name: str, ip_group_id: int, ips_to_set: Sequence[str]) -> None:
     body = {
         "id": ip_group_id,
         "reference": "",
         "comment": ip_group_name,
-        "ips": ips_to_set,
+        "ips": list(ips_to_set or []),
     }
+    _group_ips.pop(ip_group_id, None)
     _request("PUT", "/open/ipgroup", json=body)
 
 
-def append_ip_group(ip_group_id: int, ips_to_add: List[str]) -> None:
-    ips_to_add = ips_to_add or []
+def append_ip_group(ip_group_id: int, ips_to_add: Sequence[str]) -> None:
     if not ips_to_add:
         return
     body = {
         "ip_group_ids": [ip_group_id],
-        "ips": ips_to_add,
+        "ips": list(ips_to_add),
     }
+    _group_ips.pop(ip_group_id, None)
     _request("POST", "/open/ipgroup/append", json=body)
 
 
 def delete_ip_group(gid: int) -> bool:
-    body = {"ids": [gid]}
+    return delete_ip_groups([gid])
+
+
+def delete_ip_groups(gids: List[int]) -> bool:
+    gids = [int(g) for g in gids]
+    if not gids:
+        return False
+    body = {"ids": gids}
     _request("DELETE", "/open/ipgroup", json=body)
+    with _groups_lock:
+        for gid in gids:
+            _group_ips.pop(gid, None)
+        if _groups is not None:
+            for name in [n for n, i in _groups.items() if i in gids]:
+                del _groups[name]
     return True
 
 def count_groups_with_prefix(base: str) -> int:
-    resp = _request("GET", "/open/ipgroup")
-    data = resp.json()
-    prefix = f"{base}-"
-    count = 0
-    for node in data.get("data", {}).get("nodes", []):
-        comment = node.get("comment", "")
-        if isinstance(comment, str) and comment.startswith(prefix):
-            count += 1
-    return count
\ No newline at end of file
+    return len(groups_with_prefix(base))
\ No newline at end of file
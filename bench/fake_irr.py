@@ -0,0 +1,131 @@
+"""
+In-process stand-in for an IRRd whois server (whois.radb.net): answers the
+'!!', '!s', '!g', '!6', '!i' and '!q' queries used by helpers/radb.py and
+the legacy '-i origin ASn' RPSL query.
+
+Only meant for benchmarks and local experiments, never for production.
+"""
+from __future__ import annotations
+import socketserver
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+
+class FakeIRR:
+    def __init__(self, *, latency: float = 0.0) -> None:
+        self.latency = latency
+        self.routes: Dict[str, List[str]] = {}
+        self.as_sets: Dict[str, List[str]] = {}
+        self._lock = threading.Lock()
+        self.reset_stats()
+        self._server: Optional[socketserver.ThreadingTCPServer] = None
+
+    # -- lifecycle -----------------------------------------------------------
+
+    def start(self) -> "FakeIRR":
+        fake = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            # 'latency' is paid once per read from the socket, i.e. per
+            # round trip, so pipelined queries share it as they would on a WAN
+            def handle(self) -> None:
+                with fake._lock:
+                    fake.stats["connections"] += 1
+                persistent = False
+                pending = b""
+                while True:
+                    data = self.request.recv(65536)
+                    if not data:
+                        return
+                    *lines, pending = (pending + data).split(b"\n")
+                    out: List[bytes] = []
+                    closing = False
+                    if lines and fake.latency > 0:
+                        time.sleep(fake.latency)
+                    for raw in lines:
+                        q = raw.decode("ascii", "replace").strip()
+                        if not q:
+                            continue
+                        if q == "!!":
+                            persistent = True
+                            continue
+                        if q != "!q":
+                            out.append(fake.answer(q))
+                        if q == "!q" or not persistent:
+                            closing = True
+                            break
+                    self.request.sendall(b"".join(out))
+                    if closing:
+                        return
+
+        class Server(socketserver.ThreadingTCPServer):
+            daemon_threads = True
+            allow_reuse_address = True
+
+        self._server = Server(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    @property
+    def port(self) -> int:
+        assert self._server is not None, "server not started"
+        return self._server.server_address[1]
+
+    # -- data and stats ------------------------------------------------------
+
+    def add_routes(self, asn: str, prefixes: List[str]) -> None:
+        self.routes.setdefault(asn.upper(), []).extend(prefixes)
+
+    def add_as_set(self, name: str, members: List[str]) -> None:
+        self.as_sets[name.upper()] = list(members)
+
+    def reset_stats(self) -> None:
+        self.stats: Dict[str, Any] = {"connections": 0, "queries": 0}
+
+    # -- query handling ------------------------------------------------------
+
+    def _expand(self, name: str, seen: set) -> List[str]:
+        out: List[str] = []
+        for m in self.as_sets.get(name, []):
+            if m in self.as_sets:
+                if m not in seen:
+                    seen.add(m)
+                    out.extend(self._expand(m, seen))
+            else:
+                out.append(m)
+        return out
+
+    def answer(self, q: str) -> bytes:
+        with self._lock:
+            self.stats["queries"] += 1
+
+        if q.startswith("-i origin "):
+            asn = q.split()[-1].upper()
+            objs = [f"{'route6' if ':' in p else 'route'}:  {p}\norigin:  {asn}\nsource:  RADB\n"
+                    for p in self.routes.get(asn, [])]
+            return ("\n".join(objs) + "\n").encode()
+
+        if q.startswith("!s"):
+            return b"C\n"
+        if q.startswith("!g") or q.startswith("!6"):
+            v6 = q[1] == "6"
+            data = [p for p in self.routes.get(q[2:].upper(), []) if (":" in p) == v6]
+        elif q.startswith("!i"):
+            name, _, recursive = q[2:].upper().partition(",")
+            if name not in self.as_sets:
+                return b"D\n"
+            data = sorted(set(self._expand(name, {name}) if recursive == "1" else self.as_sets[name]))
+        else:
+            return b"F unrecognized command\n"
+
+        if not data:
+            return b"D\n"
+        body = " ".join(data) + "\n"
+        return f"A{len(body)}\n{body}C\n".encode()
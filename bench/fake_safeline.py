@@ -0,0 +1,211 @@
+"""
+In-process stand-in for the SafeLine open API used by api/safeline.py and
+api/rules.py (/open/ipgroup, /open/ipgroup/append, /open/policy), plus a
+static file area (/feeds/...) that serves synthetic upstream feeds.
+
+Only meant for benchmarks and local experiments, never for production.
+"""
+from __future__ import annotations
+import hashlib
+import itertools
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Mapping, Optional, Set, Tuple
+from urllib.parse import urlparse
+
+
+class FakeSafeLine:
+    def __init__(self, *, latency: float = 0.0, latency_per_kb: float = 0.0,
+                 error_rate: float = 0.0, error_status: int = 429,
+                 max_ips_per_group: int = 10_000, max_body_bytes: Optional[int] = None,
+                 seed: int = 0) -> None:
+        self.latency = latency
+        self.latency_per_kb = latency_per_kb
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.max_ips_per_group = max_ips_per_group
+        self.max_body_bytes = max_body_bytes
+        self.groups: Dict[int, Dict[str, Any]] = {}
+        self.rules: Dict[int, Dict[str, Any]] = {}
+        self.feeds: Dict[str, Tuple[bytes, str]] = {}
+        # groups (by comment) whose create and replace are answered with 500
+        self.failing_groups: Set[str] = set()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+        self.reset_stats()
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    # -- lifecycle -----------------------------------------------------------
+
+    def start(self) -> "FakeSafeLine":
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args: Any) -> None:
+                pass
+
+            def _serve(self) -> None:
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                status, body, ctype = fake.handle(self.command, self.path, raw, self.headers)
+                self.send_response(status)
+                if self.path.startswith("/feeds/") and status in (200, 304):
+                    self.send_header("ETag", fake.feed_etag(self.path[len("/feeds/"):]))
+                self.send_header("Content-Type", ctype)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = do_POST = do_PUT = do_DELETE = _serve
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    @property
+    def base_url(self) -> str:
+        assert self._server is not None, "server not started"
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    # -- feeds and stats -----------------------------------------------------
+
+    def add_feed(self, name: str, body: bytes, content_type: str = "text/plain") -> str:
+        self.feeds[name] = (body, content_type)
+        return f"{self.base_url}/feeds/{name}"
+
+    def reset_stats(self) -> None:
+        self.stats: Dict[str, Any] = {"requests": 0, "bytes_in": 0, "errors": 0, "by_endpoint": {}}
+
+    def group_contents(self) -> Dict[str, List[str]]:
+        with self._lock:
+            return {g["comment"]: list(g["ips"]) for g in self.groups.values()}
+
+    # -- request handling ----------------------------------------------------
+
+    def feed_etag(self, name: str) -> str:
+        feed = self.feeds.get(urlparse(name).path)
+        return f'"{hashlib.sha1(feed[0]).hexdigest()}"' if feed else '""'
+
+    def handle(self, method: str, path: str, raw: bytes,
+               headers: Optional[Mapping[str, str]] = None) -> Tuple[int, bytes, str]:
+        url = urlparse(path)
+        if url.path.startswith("/feeds/"):
+            name = url.path[len("/feeds/"):]
+            feed = self.feeds.get(name)
+            if feed is None:
+                return 404, b"not found", "text/plain"
+            if headers is not None and headers.get("If-None-Match") == self.feed_etag(name):
+                return 304, b"", feed[1]
+            return 200, feed[0], feed[1]
+
+        route = url.path[4:] if url.path.startswith("/api") else url.path
+        with self._lock:
+            self.stats["requests"] += 1
+            self.stats["bytes_in"] += len(raw)
+            key = f"{method} {route}"
+            self.stats["by_endpoint"][key] = self.stats["by_endpoint"].get(key, 0) + 1
+            inject = method != "GET" and self._rng.random() < self.error_rate
+
+        delay = self.latency + self.latency_per_kb * len(raw) / 1024
+        if delay > 0:
+            time.sleep(delay)
+        if inject:
+            with self._lock:
+                self.stats["errors"] += 1
+            return self._json(self.error_status, {"err": "injected", "msg": "injected error"})
+        if self.max_body_bytes is not None and len(raw) > self.max_body_bytes:
+            return self._json(413, {"err": "too-large", "msg": "request body too large"})
+
+        try:
+            body = json.loads(raw) if raw else {}
+        except ValueError:
+            return self._json(400, {"err": "bad-json", "msg": "invalid JSON"})
+
+        with self._lock:
+            if route == "/open/ipgroup/append" and method == "POST":
+                return self._append(body)
+            if route == "/open/ipgroup":
+                return self._ipgroup(method, body)
+            if route == "/open/policy":
+                return self._policy(method, body)
+        return self._json(404, {"err": "not-found", "msg": route})
+
+    def _json(self, status: int, payload: Dict[str, Any]) -> Tuple[int, bytes, str]:
+        return status, json.dumps(payload).encode(), "application/json"
+
+    def _too_many(self, ips: List[str]) -> bool:
+        return len(ips) > self.max_ips_per_group
+
+    def _ipgroup(self, method: str, body: Dict[str, Any]) -> Tuple[int, bytes, str]:
+        if method == "GET":
+            nodes = [{"id": gid, "comment": g["comment"], "reference": ""} for gid, g in self.groups.items()]
+            return self._json(200, {"data": {"nodes": nodes, "total": len(nodes)}})
+        if method in ("POST", "PUT") and body.get("comment") in self.failing_groups:
+            return self._json(500, {"err": "failing", "msg": "group write refused"})
+        if method == "POST":
+            ips = list(body.get("ips") or [])
+            if self._too_many(ips):
+                return self._json(400, {"err": "too-many-ips", "msg": "group limit exceeded"})
+            gid = next(self._ids)
+            self.groups[gid] = {"comment": body.get("comment", ""), "ips": ips}
+            return self._json(200, {"data": gid})
+        if method == "PUT":
+            group = self.groups.get(int(body.get("id", 0)))
+            if group is None:
+                return self._json(404, {"err": "not-found", "msg": "group not found"})
+            ips = list(body.get("ips") or [])
+            if self._too_many(ips):
+                return self._json(400, {"err": "too-many-ips", "msg": "group limit exceeded"})
+            group["ips"] = ips
+            group["comment"] = body.get("comment", group["comment"])
+            return self._json(200, {"data": None})
+        if method == "DELETE":
+            for gid in body.get("ids") or []:
+                self.groups.pop(int(gid), None)
+            return self._json(200, {"data": None})
+        return self._json(405, {"err": "method", "msg": method})
+
+    def _append(self, body: Dict[str, Any]) -> Tuple[int, bytes, str]:
+        ips = list(body.get("ips") or [])
+        targets = [self.groups.get(int(g)) for g in body.get("ip_group_ids") or []]
+        if any(t is None for t in targets):
+            return self._json(404, {"err": "not-found", "msg": "group not found"})
+        for group in targets:
+            if self._too_many(group["ips"] + ips):
+                return self._json(400, {"err": "too-many-ips", "msg": "group limit exceeded"})
+        for group in targets:
+            group["ips"].extend(ips)
+        return self._json(200, {"data": None})
+
+    def _policy(self, method: str, body: Dict[str, Any]) -> Tuple[int, bytes, str]:
+        if method == "GET":
+            rules = list(self.rules.values())
+            return self._json(200, {"data": {"data": rules, "total": len(rules)}})
+        if method == "POST":
+            rid = next(self._ids)
+            self.rules[rid] = {"auth_source_ids": [], "log": False, "pattern": [], **body, "id": rid}
+            return self._json(200, {"data": rid})
+        if method == "PUT":
+            rule = self.rules.get(int(body.get("id", 0)))
+            if rule is None:
+                return self._json(404, {"err": "not-found", "msg": "rule not found"})
+            rule.update(body)
+            return self._json(200, {"data": None})
+        if method == "DELETE":
+            self.rules.pop(int(body.get("id", 0)), None)
+            return self._json(200, {"data": None})
+        return self._json(405, {"err": "method", "msg": method})
@@ -0,0 +1,226 @@
+"""
+End-to-end sync benchmark: runs main.py against bench.fake_safeline with
+synthetic feeds and reports, per source kind, wall time, SafeLine request
+count, bytes sent and peak memory of the sync process.
+
+    python -m bench.run_bench --entries 100000 --latency 0.02
+
+Every kind is run three times on the same state: 'cold' (empty SafeLine),
+'warm' (unchanged feeds, should cost next to nothing) and 'replay' (SafeLine
+wiped, main.py --replay must restore the same groups from persist/raw).
+After every run the rules must reference exactly the groups that exist, so
+a run with --error-rate shows whether the sync still converges; a failed
+check sets the exit column to -1.
+"""
+from __future__ import annotations
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+import yaml
+
+from bench.fake_irr import FakeIRR
+from bench.fake_safeline import FakeSafeLine
+
+REPO = Path(__file__).resolve().parent.parent
+KINDS = ["json-cidrs", "txt-cidrs", "txt-scored", "abuseipdb", "whois-radb"]
+
+# Linux keeps ru_maxrss across fork+exec, so a child started from this
+# (large) process would report our RSS. A small launcher starts main.py
+# instead and writes the grandchild's peak RSS (KiB) to argv[1].
+_LAUNCHER = (
+    "import os, subprocess, sys\n"
+    "p = subprocess.Popen(sys.argv[2:])\n"
+    "_, status, usage = os.wait4(p.pid, 0)\n"
+    "open(sys.argv[1], 'w').write(str(usage.ru_maxrss))\n"
+    "sys.exit(os.waitstatus_to_exitcode(status))\n"
+)
+
+UPLOAD = {
+    "max_per_group": 10000,
+    "initial_batch_size": 10000,
+    "append_batch_size": 500,
+    "sleep_between_batches": 0.0,
+    "cleanup": "delete",
+    "placeholder_ip": "192.0.2.1",
+}
+
+
+def _ipv4(rng: random.Random) -> str:
+    return f"{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}"
+
+
+def _ipv4s(rng: random.Random, n: int) -> List[str]:
+    out = set()
+    while len(out) < n:
+        out.add(_ipv4(rng))
+    return sorted(out)
+
+
+def build_sources(fake: FakeSafeLine, irr: FakeIRR, entries: int, seed: int,
+                  aggregate: bool = False) -> Dict[str, Dict[str, Any]]:
+    rng = random.Random(seed)
+    sources: Dict[str, Dict[str, Any]] = {}
+
+    prefixes = [{"ipv4Prefix": f"{ip.rsplit('.', 1)[0]}.0/24"} for ip in _ipv4s(rng, min(entries, 2000))]
+    body = json.dumps({"creationTime": "2025-01-01T00:00:00", "prefixes": prefixes}).encode()
+    sources["bench-json"] = {
+        "kind": "json-cidrs",
+        "urls": [fake.add_feed("crawler.json", body, "application/json")],
+        "json": {"timestamp_field": "creationTime", "cidr_fields": ["ipv4Prefix", "ipv6Prefix"]},
+    }
+
+    body = "\n".join(f"{ip}/32" for ip in _ipv4s(rng, entries)).encode()
+    sources["bench-txt"] = {"kind": "txt-cidrs", "urls": [fake.add_feed("cidrs.txt", body)]}
+
+    lines = ["# ipsum-like feed"] + [f"{ip}\t{rng.choice([1, 1, 1, 2, 2, 3, 4, 5])}" for ip in _ipv4s(rng, entries)]
+    sources["bench-scored"] = {
+        "kind": "txt-scored",
+        "urls": [fake.add_feed("ipsum.txt", "\n".join(lines).encode())],
+        "txt": {"field_sep": "\t", "ip_index": 0, "score_index": 1},
+        "exclude_from": [],
+        "levels": [{"level": lvl, "enabled": True, "rules": {"policy": "deny", "enabled": True}} for lvl in range(1, 6)],
+    }
+
+    data = [{"ipAddress": ip, "abuseConfidenceScore": 100} for ip in _ipv4s(rng, entries)]
+    body = json.dumps({"meta": {"generatedAt": "2025-01-01T00:00:00+00:00"}, "data": data}).encode()
+    sources["bench-abuseip"] = {
+        "kind": "abuseipdb",
+        "api": {"url": fake.add_feed("abuseipdb", body, "application/json"), "confidence_min": 90},
+    }
+
+    # one large single-ASN network and an AS-SET of 200 small ones (nested)
+    prefixes = [f"{ip.rsplit('.', 1)[0]}.0/24" for ip in _ipv4s(rng, min(entries, 20000))]
+    irr.add_routes("AS64500", prefixes[:len(prefixes) // 2])
+    members = [f"AS{65000 + i}" for i in range(200)]
+    for i, asn in enumerate(members):
+        irr.add_routes(asn, prefixes[len(prefixes) // 2 + i::200] + [f"2001:db8:{i:x}::/48"])
+    irr.add_as_set("AS-BENCH-SUB", members[100:])
+    irr.add_as_set("AS-BENCH", members[:100] + ["AS-BENCH-SUB"])
+    whois = {"server": "127.0.0.1", "port": irr.port}
+    sources["bench-radb"] = {"kind": "whois-radb", "radb": {"asn": "AS64500", **whois}}
+    sources["bench-radb-set"] = {"kind": "whois-radb", "radb": {"as_sets": ["AS-BENCH"], **whois}}
+
+    for name, cfg in sources.items():
+        cfg.update({"enabled": True, "group_base": name, "change_detector": "hash", "aggregate": aggregate})
+        cfg.setdefault("rules", {"policy": "deny", "enabled": True})
+        cfg["upload"] = dict(UPLOAD)
+    return sources
+
+
+def rules_consistent(fake: FakeSafeLine) -> bool:
+    """
+    Every rule points only at existing groups, and every group is in a rule.
+    """
+    referenced = set()
+    for rule in fake.rules.values():
+        for clause in rule.get("pattern") or []:
+            for cond in clause:
+                referenced.update(int(v) for v in cond.get("v") or [])
+    return referenced == set(fake.groups)
+
+
+def run_sync(workdir: Path, fake: FakeSafeLine, kind: str, *extra: str) -> Dict[str, Any]:
+    env = dict(os.environ)
+    env.update({
+        "SAFELINE_BASE_URL": f"{fake.base_url}/api",
+        "SAFELINE_API_TOKEN": "bench",
+        "ABUSEIPDB_KEY": "bench",
+        "STATE_PATH": str(workdir / "persist" / ".ipranges_state.json"),
+        "LOG_LEVEL": env.get("LOG_LEVEL", "WARNING"),
+        "PYTHONPATH": str(REPO),
+    })
+    rss_file = workdir / "maxrss"
+    fake.reset_stats()
+    t0 = time.perf_counter()
+    returncode = subprocess.call(
+        [sys.executable, "-c", _LAUNCHER, str(rss_file), sys.executable, str(REPO / "main.py"), "--kind", kind, *extra],
+        cwd=workdir, env=env,
+    )
+    wall = time.perf_counter() - t0
+    maxrss_kb = int(rss_file.read_text() or 0) if rss_file.exists() else 0
+    return {
+        "exit": returncode,
+        "wall_s": round(wall, 3),
+        "requests": fake.stats["requests"],
+        "bytes_sent": fake.stats["bytes_in"],
+        "errors_injected": fake.stats["errors"],
+        # ru_maxrss is KiB on Linux
+        "peak_rss_mb": round(maxrss_kb / 1024, 1),
+        "by_endpoint": dict(fake.stats["by_endpoint"]),
+    }
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description="Benchmark main.py against a fake SafeLine.")
+    p.add_argument("--entries", type=int, default=50_000, help="Entries per large synthetic feed.")
+    p.add_argument("--kinds", nargs="*", default=KINDS, choices=KINDS)
+    p.add_argument("--latency", type=float, default=0.0, help="Fixed latency per SafeLine request (s).")
+    p.add_argument("--latency-per-kb", type=float, default=0.0, help="Extra latency per KiB of request body (s).")
+    p.add_argument("--whois-latency", type=float, default=0.0, help="Latency per whois query (s).")
+    p.add_argument("--error-rate", type=float, default=0.0, help="Share of write requests answered with an error.")
+    p.add_argument("--error-status", type=int, default=429)
+    p.add_argument("--max-body-bytes", type=int, default=None, help="Reject larger request bodies with 413.")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--aggregate", action="store_true", help="Enable CIDR aggregation on all sources.")
+    p.add_argument("--json", action="store_true", help="Print the results as JSON.")
+    args = p.parse_args()
+
+    fake = FakeSafeLine(
+        latency=args.latency,
+        latency_per_kb=args.latency_per_kb,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        max_body_bytes=args.max_body_bytes,
+        seed=args.seed,
+    ).start()
+    irr = FakeIRR(latency=args.whois_latency).start()
+    results: List[Dict[str, Any]] = []
+    try:
+        with tempfile.TemporaryDirectory(prefix="safeline-bench-") as tmp:
+            workdir = Path(tmp)
+            sources_dir = workdir / "config" / "sources.d"
+            sources_dir.mkdir(parents=True)
+            for name, cfg in build_sources(fake, irr, args.entries, args.seed, args.aggregate).items():
+                if cfg["kind"] in args.kinds:
+                    (sources_dir / f"{name}.yaml").write_text(yaml.safe_dump(cfg), encoding="utf-8")
+            for kind in args.kinds:
+                fake.groups.clear()
+                fake.rules.clear()
+                for phase in ("cold", "warm"):
+                    res = run_sync(workdir, fake, kind)
+                    res["consistent"] = rules_consistent(fake)
+                    if not res["consistent"]:
+                        res["exit"] = res["exit"] or -1
+                    results.append({"kind": kind, "phase": phase, **res})
+                pushed = {k: sorted(v) for k, v in fake.group_contents().items()}
+                fake.groups.clear()
+                fake.rules.clear()
+                res = run_sync(workdir, fake, kind, "--replay")
+                res["restored"] = {k: sorted(v) for k, v in fake.group_contents().items()} == pushed
+                res["consistent"] = rules_consistent(fake)
+                if not (res["restored"] and res["consistent"]):
+                    res["exit"] = res["exit"] or -1
+                results.append({"kind": kind, "phase": "replay", **res})
+    finally:
+        fake.stop()
+        irr.stop()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'kind':<12} {'phase':<6} {'exit':>4} {'wall s':>8} {'requests':>9} {'bytes sent':>12} {'peak MB':>8}")
+    for r in results:
+        print(f"{r['kind']:<12} {r['phase']:<6} {r['exit']:>4} {r['wall_s']:>8} {r['requests']:>9} "
+              f"{r['bytes_sent']:>12} {r['peak_rss_mb']:>8}")
+
+
+if __name__ == "__main__":
+    main()
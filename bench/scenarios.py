@@ -0,0 +1,153 @@
+"""
+Scenarios: runs main.py against bench.fake_safeline with small feeds
+through runs that are easy to get wrong (SafeLine refusing some writes, a
+level skipped as unchanged) and checks that the sync leaves groups, rules
+and state consistent and converges once SafeLine recovers.
+
+    python -m bench.scenarios
+
+Exits non-zero if any scenario ends in a state it should not.
+"""
+from __future__ import annotations
+import argparse
+import sys
+import tempfile
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+import yaml
+
+from bench.fake_safeline import FakeSafeLine
+from bench.run_bench import rules_consistent, run_sync
+
+
+def _ips(start: int, n: int) -> List[str]:
+    return [f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}" for i in range(start, start + n)]
+
+
+def _txt_source(fake: FakeSafeLine, workdir: Path, name: str, entries: List[str],
+                **upload: Any) -> None:
+    cfg = {
+        "enabled": True,
+        "kind": "txt-cidrs",
+        "group_base": name,
+        "change_detector": "hash",
+        "urls": [fake.add_feed(f"{name}.txt", "\n".join(entries).encode())],
+        "rules": {"policy": "deny", "enabled": True},
+        "upload": _upload(max_per_group=1000, **upload),
+    }
+    _write_source(workdir, name, cfg)
+
+
+def _upload(**upload: Any) -> Dict[str, Any]:
+    return {"initial_batch_size": 1000, "append_batch_size": 500, "sleep_between_batches": 0.0,
+            "cleanup": "delete", **upload}
+
+
+def _write_source(workdir: Path, name: str, cfg: Dict[str, Any]) -> None:
+    sources = workdir / "config" / "sources.d"
+    sources.mkdir(parents=True, exist_ok=True)
+    (sources / f"{name}.yaml").write_text(yaml.safe_dump(cfg), encoding="utf-8")
+
+
+def _rule_groups(fake: FakeSafeLine, name: str) -> List[str]:
+    by_id = {gid: g["comment"] for gid, g in fake.groups.items()}
+    for rule in fake.rules.values():
+        if rule.get("name") == name:
+            ids = [int(v) for clause in rule.get("pattern") or [] for c in clause for v in c.get("v") or []]
+            return sorted(by_id.get(i, f"missing #{i}") for i in ids)
+    return []
+
+
+def middle_group_fails(fake: FakeSafeLine, workdir: Path) -> List[str]:
+    """
+    The middle one of three groups cannot be created, then can.
+    """
+    problems: List[str] = []
+    entries = _ips(0, 3000)
+    _txt_source(fake, workdir, "mid", entries)
+    names = [f"parc_mid-00{i}" for i in (1, 2, 3)]
+
+    fake.failing_groups = {names[1]}
+    run_sync(workdir, fake, "txt-cidrs")
+    groups = fake.group_contents()
+    if sorted(groups) != [names[0], names[2]]:
+        problems.append(f"failed run: groups {sorted(groups)}, expected {names[0]} and {names[2]} kept")
+    if fake.rules:
+        problems.append(f"failed run: rule created with {_rule_groups(fake, 'parc_mid')}")
+
+    fake.failing_groups = set()
+    run_sync(workdir, fake, "txt-cidrs")
+    groups = fake.group_contents()
+    if sorted(x for g in groups.values() for x in g) != sorted(entries):
+        problems.append(f"next run: groups hold {sum(map(len, groups.values()))} of {len(entries)} entries")
+    if _rule_groups(fake, "parc_mid") != names or not rules_consistent(fake):
+        problems.append(f"next run: rule points at {_rule_groups(fake, 'parc_mid')}")
+    return problems
+
+
+def skipped_level_empty_groups(fake: FakeSafeLine, workdir: Path) -> List[str]:
+    """
+    Cumulative txt-scored source whose level 3 has empty hash buckets; the
+    next run changes only level 1, so level 3 is skipped as unchanged, and
+    the rules must still leave its placeholder groups out.
+    """
+    problems: List[str] = []
+    placeholder = "192.0.2.1"
+    level3 = "".join(f"10.0.0.{i}\t3\n" for i in range(1, 4))
+    cfg = {
+        "enabled": True,
+        "kind": "txt-scored",
+        "group_base": "cum",
+        "change_detector": "hash",
+        "cumulative": True,
+        "urls": [fake.add_feed("cum.txt", (level3 + "4.4.4.4\t1\n").encode())],
+        "levels": [{"level": lvl, "rules": {"policy": "deny"}} for lvl in (1, 3)],
+        "upload": _upload(max_per_group=2, partition="hash", placeholder_ip=placeholder),
+    }
+    _write_source(workdir, "cum", cfg)
+
+    for run in ("first run", "level 1 changed"):
+        run_sync(workdir, fake, "txt-scored")
+        empty = {g for g, ips in fake.group_contents().items() if ips == [placeholder]}
+        if not empty:
+            problems.append(f"{run}: no empty bucket, the scenario tests nothing")
+        for rule in ("parc_cum-l1", "parc_cum-l3"):
+            groups = _rule_groups(fake, rule)
+            if not groups or empty & set(groups):
+                problems.append(f"{run}: {rule} points at {groups}, empty: {sorted(empty)}")
+        fake.add_feed("cum.txt", (level3 + "4.4.4.4\t1\n6.6.6.6\t1\n").encode())
+    return problems
+
+
+SCENARIOS: Dict[str, Callable[[FakeSafeLine, Path], List[str]]] = {
+    "middle_group_fails": middle_group_fails,
+    "skipped_level_empty_groups": skipped_level_empty_groups,
+}
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description="Run main.py through SafeLine failures.")
+    p.add_argument("--scenarios", nargs="*", default=list(SCENARIOS), choices=list(SCENARIOS))
+    args = p.parse_args()
+
+    failed = 0
+    for name in args.scenarios:
+        fake = FakeSafeLine().start()
+        try:
+            with tempfile.TemporaryDirectory(prefix="safeline-scenario-") as tmp:
+                problems = SCENARIOS[name](fake, Path(tmp))
+        finally:
+            fake.stop()
+        if problems:
+            failed += 1
+            print(f"{name:<28} FAIL")
+            for line in problems:
+                print(f"  {line}")
+        else:
+            print(f"{name:<28} ok")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
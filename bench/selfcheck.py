@@ -0,0 +1,277 @@
+"""
+Randomized self-check of the address helpers against the standard library
+ipaddress module. Entries are drawn from small IPv4 and IPv6 blocks so that
+overlaps, nesting and adjacency are frequent. Set fingerprints are checked
+for order independence and for accepting hashes stored by older versions.
+
+    python -m bench.selfcheck --rounds 500 --seed 1
+
+Exits non-zero and prints the failing input if any check disagrees.
+"""
+from __future__ import annotations
+import argparse
+import ipaddress
+import operator
+import random
+import sys
+from typing import Callable, Dict, List, Set, Tuple, Union
+
+from helpers.aggregate import aggregate_cidrs
+from helpers.cidr_index import CIDRIndex
+from helpers.hash import SetFingerprint, _hash_list, fingerprint_matches, set_fingerprint
+from helpers.ipset import IPSet, IPSetBuilder
+
+Network = Union[ipaddress.IPv4Network, ipaddress.IPv6Network]
+
+# 10.0.0.0/22 and 2001:db8::/118, 1024 addresses each
+_BLOCKS = ((0x0A000000, 32), (0x20010DB8 << 96, 128))
+_SPAN = 10
+# not addresses: kept as strings by IPSet, dropped by normalization
+_JUNK = ("bogus", "10.0.0.1/33", "010.0.0.1", "2001:db8::/129", "10.0.0", "")
+
+
+class CheckFailed(Exception):
+    pass
+
+
+def _expect(ok: bool, what: str, entries: object) -> None:
+    if not ok:
+        raise CheckFailed(f"{what}\n  input: {entries!r}")
+
+
+def random_entries(rng: random.Random, n: int) -> List[str]:
+    """
+    Addresses and prefixes inside the test blocks, host bits possibly set.
+    """
+    out: List[str] = []
+    for _ in range(n):
+        base, bits = rng.choice(_BLOCKS)
+        addr = base + rng.randrange(1 << _SPAN)
+        plen = rng.choice([bits, bits, rng.randrange(bits - _SPAN, bits + 1)])
+        ip = ipaddress.ip_address(addr)
+        out.append(str(ip) if plen == bits and rng.random() < 0.5 else f"{ip}/{plen}")
+    return out
+
+
+def with_junk(rng: random.Random, entries: List[str]) -> List[str]:
+    for _ in range(rng.randrange(3)):
+        entries.insert(rng.randrange(len(entries) + 1), rng.choice(_JUNK))
+    return entries
+
+
+def canonical(n: Network) -> str:
+    return str(n.network_address) if n.prefixlen == n.max_prefixlen else str(n)
+
+
+def reference(entries: List[str]) -> Tuple[Set[Network], Set[str]]:
+    """
+    The networks of the entries, and those that are not addresses.
+    """
+    nets: Set[Network] = set()
+    other: Set[str] = set()
+    for e in entries:
+        try:
+            nets.add(ipaddress.ip_network(e, strict=False))
+        except ValueError:
+            other.add(e)
+    return nets, other
+
+
+def ordered(nets: Set[Network], other: Set[str]) -> List[str]:
+    """
+    Entries in IPSet order: IPv4, IPv6, then the rest, numerically.
+    """
+    key = lambda n: (n.version, int(n.network_address), n.prefixlen)
+    return [canonical(n) for n in sorted(nets, key=key)] + sorted(other)
+
+
+def networks(entries: List[str]) -> List[Network]:
+    return [ipaddress.ip_network(e, strict=False) for e in entries]
+
+
+def addresses(nets: List[Network]) -> Set[Tuple[int, int]]:
+    """
+    Every (version, address) covered by the networks; test blocks are small.
+    """
+    out: Set[Tuple[int, int]] = set()
+    for n in nets:
+        first = int(n.network_address)
+        out.update((n.version, a) for a in range(first, first + n.num_addresses))
+    return out
+
+
+def capped(nets: List[Network], min_prefix: Dict[int, int]) -> List[Network]:
+    """
+    What aggregation with a minimum prefix length should give: entries
+    already shorter than it (the outermost ones) as they are, the rest
+    collapsed and split down to it.
+    """
+    wide = [n for n in nets if n.prefixlen < min_prefix[n.version]]
+    wide = [n for n in wide if not any(n != w and n.subnet_of(w) for w in wide if w.version == n.version)]
+    rest = addresses(nets) - addresses(wide)
+    out = set(wide)
+    for version in (4, 6):
+        hosts = [ipaddress.ip_address(a) for v, a in rest if v == version]
+        for n in ipaddress.collapse_addresses(hosts):
+            out.update(n.subnets(new_prefix=min_prefix[version]) if n.prefixlen < min_prefix[version] else [n])
+    return sorted(out, key=lambda n: (n.version, int(n.network_address), n.prefixlen))
+
+
+def check_aggregate(rng: random.Random) -> None:
+    # wide entries are kept, not split down to the minimum prefix length
+    for entry, opts in (("10.0.0.0/8", {"min_prefix_v4": 16}), ("2001:db8::/32", {"min_prefix_v6": 48})):
+        got = aggregate_cidrs([entry], **opts)
+        _expect(got == [entry], f"aggregate_cidrs({opts}) → {len(got)} entries", [entry])
+
+    entries = random_entries(rng, rng.randrange(1, 60))
+    nets = networks(entries)
+    expected = [n for v in (4, 6) for n in ipaddress.collapse_addresses(x for x in nets if x.version == v)]
+    got = aggregate_cidrs(entries)
+    _expect(networks(got) == expected, f"aggregate_cidrs → {got}", entries)
+    packed = aggregate_cidrs(IPSet.from_strings(entries))
+    _expect(packed == got, f"aggregate_cidrs(IPSet) → {packed}, from strings {got}", entries)
+
+    min4, min6 = rng.randrange(22, 33), rng.randrange(118, 129)
+    got = aggregate_cidrs(entries, min_prefix_v4=min4, min_prefix_v6=min6)
+    expected = capped(nets, {4: min4, 6: min6})
+    _expect(networks(got) == expected,
+            f"aggregate_cidrs(min {min4}/{min6}) → {got}, expected {[canonical(n) for n in expected]}", entries)
+
+
+def check_ipset(rng: random.Random) -> None:
+    ea = with_junk(rng, random_entries(rng, rng.randrange(0, 40)))
+    eb = with_junk(rng, random_entries(rng, rng.randrange(0, 40)) + rng.sample(ea, len(ea) // 2))
+    a, b = IPSet.from_strings(ea), IPSet.from_strings(eb)
+    (na, oa), (nb, ob) = reference(ea), reference(eb)
+    _expect(list(a) == ordered(na, oa), f"IPSet → {list(a)}", ea)
+    _expect(len(a) == len(na) + len(oa), f"len(IPSet) = {len(a)}", ea)
+
+    for sym, op in (("|", operator.or_), ("-", operator.sub), ("&", operator.and_)):
+        got, want = list(op(a, b)), ordered(op(na, nb), op(oa, ob))
+        _expect(got == want, f"a {sym} b → {got}, expected {want}", (ea, eb))
+
+    keep = [rng.random() < 0.5 for _ in range(len(a))]
+    got, want = a.subset(keep).to_list(), [e for e, k in zip(a, keep) if k]
+    _expect(got == want, f"subset → {got}, expected {want}", ea)
+
+    for e in eb:
+        n = ipaddress.ip_network(e, strict=False) if e not in ob else None
+        want = n in na if n is not None else e in oa
+        _expect((e in a) == want, f"{e!r} in a → {e in a}", ea)
+
+
+def check_cidr_index(rng: random.Random) -> None:
+    ea = random_entries(rng, rng.randrange(0, 20))
+    eb = with_junk(rng, random_entries(rng, rng.randrange(0, 40)))
+    index = CIDRIndex(IPSet.from_strings(ea) if rng.random() < 0.5 else ea)
+    covered = addresses(networks(ea))
+    kept, dropped, cut = index.filter(eb)
+
+    inside = partial = 0
+    outside: Set[Tuple[int, int]] = set()
+    for e in eb:
+        try:
+            own = addresses([ipaddress.ip_network(e, strict=False)])
+        except ValueError:
+            _expect(e in kept, f"{e!r} dropped, but it is not an address", (ea, eb))
+            continue
+        hit = own & covered
+        inside += hit == own
+        partial += bool(hit) and hit != own
+        outside |= own - covered
+        _expect(index.covers(e) == (hit == own), f"covers({e!r}) → {index.covers(e)}", (ea, eb))
+        if not hit:
+            _expect(e in kept, f"{e!r} dropped, but it lies outside the index", (ea, eb))
+    _expect((dropped, cut) == (inside, partial), f"filter → {dropped} dropped, {cut} cut", (ea, eb))
+    got = addresses(reference(kept)[0])
+    _expect(got == outside, f"filter keeps {len(got)} addresses, expected {len(outside)}: {kept}", (ea, eb))
+
+    # the packed path gives the same set, duplicates removed
+    s = IPSet.from_strings(eb)
+    kept_set, dropped, cut = index.filter_set(s)
+    want = IPSet.from_strings(index.filter(s)[0]).to_list()
+    _expect(kept_set.to_list() == want, f"filter_set keeps {kept_set.to_list()}, filter {want}", (ea, eb))
+    _expect((dropped, cut) == index.filter(s)[1:], f"filter_set → {dropped} dropped, {cut} cut", (ea, eb))
+
+
+def spelled_out(rng: random.Random, entry: str) -> str:
+    """
+    The same entry written the long way round: /32 or /128 on hosts,
+    uncompressed or upper-case IPv6.
+    """
+    n = ipaddress.ip_network(entry, strict=False)
+    addr, _, plen = entry.partition("/")
+    if n.version == 6:
+        addr = rng.choice([ipaddress.ip_address(addr).exploded, addr.upper()])
+    return f"{addr}/{plen or n.max_prefixlen}" if plen or rng.random() < 0.5 else addr
+
+
+def check_normalize(rng: random.Random) -> None:
+    entries = random_entries(rng, rng.randrange(0, 40))
+    entries = with_junk(rng, [spelled_out(rng, e) if rng.random() < 0.3 else e for e in entries])
+    b = IPSetBuilder(keep_invalid=False)
+    b.update(entries)
+    got = b.build().to_list()
+    nets, other = reference(entries)
+    _expect(got == ordered(nets, set()), f"normalized → {got}", entries)
+    rewritten = sum(1 for e in entries if e not in other and canonical(ipaddress.ip_network(e, strict=False)) != e)
+    counts = (b.total, b.invalid, b.rewritten)
+    _expect(counts == (len(entries), sum(e in other for e in entries), rewritten),
+            f"total/invalid/rewritten → {counts}", entries)
+
+
+def check_fingerprint(rng: random.Random) -> None:
+    entries = IPSet.from_strings(random_entries(rng, rng.randrange(1, 40))).to_list()
+    shuffled = rng.sample(entries, len(entries))
+    fp = set_fingerprint(entries)
+    _expect(set_fingerprint(shuffled) == fp, "fingerprint depends on the order", entries)
+    one = SetFingerprint()
+    for e in shuffled:
+        one.add(e)
+    _expect(one.hexdigest() == fp, "add() one by one differs from update()", entries)
+
+    changed = entries[1:] if rng.random() < 0.5 else entries + ["192.0.2.1"]
+    _expect(set_fingerprint(changed) != fp, "fingerprint misses a change", (entries, changed))
+    _expect(fingerprint_matches(fp, fp, shuffled), "same fingerprint counts as a change", entries)
+    _expect(not fingerprint_matches(fp, set_fingerprint(changed), changed), "new fingerprint not a change", changed)
+
+    # a hash stored by an older version is checked against the entries once
+    legacy = _hash_list(entries)
+    _expect(fingerprint_matches(legacy, fp, shuffled), "legacy hash of the same set counts as a change", entries)
+    _expect(not fingerprint_matches(legacy, set_fingerprint(changed), changed),
+            "legacy hash of another set not a change", (entries, changed))
+    _expect(not fingerprint_matches(None, fp, entries), "missing hash not a change", entries)
+
+
+CHECKS: Dict[str, Callable[[random.Random], None]] = {
+    "aggregate": check_aggregate,
+    "ipset": check_ipset,
+    "cidr_index": check_cidr_index,
+    "normalize": check_normalize,
+    "fingerprint": check_fingerprint,
+}
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description="Compare the address helpers with the ipaddress module.")
+    p.add_argument("--rounds", type=int, default=300, help="Random inputs per check.")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--checks", nargs="*", default=list(CHECKS), choices=list(CHECKS))
+    args = p.parse_args()
+
+    rng = random.Random(args.seed)
+    failed = 0
+    for name in args.checks:
+        try:
+            for _ in range(args.rounds):
+                CHECKS[name](rng)
+        except CheckFailed as e:
+            failed += 1
+            print(f"{name:<12} FAIL {e}")
+            continue
+        print(f"{name:<12} ok")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,10 @@ from pydantic_settings import BaseSettings, SettingsConfigDict
 class Settings(BaseSettings):
     SAFELINE_BASE_URL: str
     SAFELINE_API_TOKEN: str
+    SAFELINE_MAX_CONCURRENCY: int = 4
+    FETCH_CONCURRENCY: int = 4
+    RAW_CACHE_KEEP: int = 3
+    RAW_CACHE_MAX_MB: int = 512
 
     ABUSEIPDB_KEY: str | None = None
 
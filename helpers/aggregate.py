@@ -0,0 +1,130 @@
+from __future__ import annotations
+from typing import Any, Dict, Iterable, List, Optional, Union
+
+from helpers import log
+from helpers.ipnum import Range, format_prefix, range_to_prefixes, split_ranges
+from helpers.ipset import IPSet
+
+
+def merge_ranges(packed: List[int], bits: int) -> List[Range]:
+    """
+    Sort ranges packed by split_ranges() and merge overlapping and
+    adjacent ones.
+    """
+    packed.sort()
+    mask = (1 << bits) - 1
+    out: List[Range] = []
+    cur_first = cur_last = -2
+    for r in packed:
+        first = r >> bits
+        last = r & mask
+        if first <= cur_last + 1:
+            if last > cur_last:
+                cur_last = last
+            continue
+        if cur_last >= 0:
+            out.append((cur_first, cur_last))
+        cur_first, cur_last = first, last
+    if cur_last >= 0:
+        out.append((cur_first, cur_last))
+    return out
+
+
+def _wide_entries(packed: List[int], bits: int, min_prefix: int) -> Dict[int, int]:
+    """
+    first → last address of the outermost entries already shorter than
+    min_prefix.
+    """
+    wide: Dict[int, int] = {}
+    if not min_prefix:
+        return wide
+    mask = (1 << bits) - 1
+    limit = 1 << (bits - min_prefix)
+    # prefixes are either nested or disjoint; of those starting at the same
+    # address the widest comes first
+    end = -1
+    for first, neg_last in sorted((r >> bits, -(r & mask)) for r in packed if (r & mask) - (r >> bits) >= limit):
+        if first > end:
+            end = wide[first] = -neg_last
+    return wide
+
+
+def _cut(ranges: List[Range], wide: Dict[int, int]) -> List[Range]:
+    """
+    The merged ranges with the wide entries cut out as ranges of their own.
+    """
+    out: List[Range] = []
+    starts = sorted(wide)
+    j = 0
+    for first, last in ranges:
+        while j < len(starts) and starts[j] <= last:
+            w_first = starts[j]
+            if first < w_first:
+                out.append((first, w_first - 1))
+            out.append((w_first, wide[w_first]))
+            first = wide[w_first] + 1
+            j += 1
+        if first <= last:
+            out.append((first, last))
+    return out
+
+
+def aggregate_cidrs(entries: Union[IPSet, Iterable[str]], *,
+                    min_prefix_v4: int = 0, min_prefix_v6: int = 0) -> List[str]:
+    """
+    Collapse addresses and prefixes into the smallest set of prefixes that
+    covers exactly the same addresses. Nested and duplicate entries vanish,
+    adjacent ones are joined, but never into a prefix shorter than
+    min_prefix_v4 / min_prefix_v6; entries already shorter are kept as they
+    are, not split. Entries that are not addresses are kept as they are.
+    """
+    if isinstance(entries, IPSet):
+        v4, v6 = entries.ranges()
+        invalid = list(entries.other)
+    else:
+        v4, v6, invalid = split_ranges(entries)
+    out: List[str] = []
+    for version, packed, bits, min_prefix in ((4, v4, 32, min_prefix_v4), (6, v6, 128, min_prefix_v6)):
+        wide = _wide_entries(packed, bits, min_prefix)
+        ranges = merge_ranges(packed, bits)
+        if wide:
+            ranges = _cut(ranges, wide)
+        for first, last in ranges:
+            if first == last:
+                out.append(format_prefix(version, first, bits))
+                continue
+            cap = 0 if wide.get(first) == last else min_prefix
+            for net, plen in range_to_prefixes(first, last, bits, cap):
+                out.append(format_prefix(version, net, plen))
+    out.extend(sorted(set(invalid)))
+    return out
+
+
+def aggregate_options(cfg: Dict[str, Any]) -> Optional[Dict[str, int]]:
+    """
+    The source's 'aggregate' setting: false/missing → None, true → no
+    limit, or a dict with enabled / min_prefix_v4 / min_prefix_v6.
+    """
+    agg = cfg.get("aggregate")
+    if not agg:
+        return None
+    if not isinstance(agg, dict):
+        return {"min_prefix_v4": 0, "min_prefix_v6": 0}
+    if not agg.get("enabled", True):
+        return None
+    return {
+        "min_prefix_v4": int(agg.get("min_prefix_v4", 0)),
+        "min_prefix_v6": int(agg.get("min_prefix_v6", 0)),
+    }
+
+
+def maybe_aggregate(label: str, cfg: Dict[str, Any], entries: IPSet) -> IPSet:
+    """
+    aggregate_cidrs() if the source enables it, else entries unchanged.
+    """
+    opts = aggregate_options(cfg)
+    if opts is None:
+        return entries
+    out = IPSet.from_strings(aggregate_cidrs(entries, **opts))
+    log.info("%s: aggregated %d → %d entries", label, len(entries), len(out))
+    return out
@@ -1,5 +1,42 @@
-from typing import Dict, Iterable, Optional, Tuple
-from helpers.hash import _hash_list
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Sequence, Tuple
+import threading
+from helpers.hash import fingerprint_matches, set_fingerprint
+from helpers.fetch import replaying
+
+# set on the thread pushing a source whose config changed (see forced_change)
+_forced = threading.local()
+
+
+@contextmanager
+def forced_change(on: bool = True) -> Iterator[None]:
+    """
+    Within the block nothing counts as unchanged on this thread, so a source
+    whose config changed is pushed although its entries are the same.
+    """
+    _forced.on = on
+    try:
+        yield
+    finally:
+        _forced.on = False
+
+
+def _must_push() -> bool:
+    return replaying() or getattr(_forced, "on", False)
+
+
+def unchanged(prev_hash: Optional[str], new_hash: str, entries: Optional[Sequence[str]] = None) -> bool:
+    """
+    Same hash as last run. Never true in replay mode, which pushes again,
+    nor within forced_change().
+    With entries, a legacy hash in the state is checked against them.
+    """
+    if _must_push():
+        return False
+    if entries is not None:
+        return fingerprint_matches(prev_hash, new_hash, entries)
+    return prev_hash == new_hash
+
 
 def decide_change(
     detector: str,
@@ -8,15 +45,17 @@ def decide_change(
     state_key_ts: Optional[str],
     state_key_hash: str,
     new_ts: Optional[str],
-    entries: Iterable[str],
+    entries: Sequence[str],
 ) -> Tuple[bool, Dict[str, object]]:
     detector = (detector or "timestamp").lower()
     state_updates: Dict[str, object] = {}
 
     if detector == "hash" or (detector == "auto" and not new_ts):
-        new_hash = _hash_list(entries)
+        new_hash = set_fingerprint(entries)
         prev_hash = state.get(state_key_hash)
-        if prev_hash == new_hash:
+        if unchanged(prev_hash, new_hash, entries):
+            # rewrites a legacy hash in the new format
+            state_updates[state_key_hash] = new_hash
             if state_key_ts and new_ts:
                 state_updates[state_key_ts] = new_ts
             return False, state_updates
@@ -28,7 +67,7 @@ def decide_change(
     prev_ts = state.get(state_key_ts) if state_key_ts else None
     if state_key_ts is None or new_ts is None:
         return True, state_updates
-    if prev_ts == new_ts:
+    if prev_ts == new_ts and not _must_push():
         return False, state_updates
     state_updates[state_key_ts] = new_ts
     return True, state_updates
\ No newline at end of file
@@ -1,6 +1,82 @@
-from typing import List
+from __future__ import annotations
+from typing import Iterator, List, Optional, Sequence, Union, overload
+import zlib
 
-def chunk_list(items: List[str], size: int) -> List[List[str]]:
+
+class Block(Sequence[str]):
+    """
+    Read-only view of items[start:stop] without copying. Slicing a view
+    gives another view of the same list, so groups and batches cut from one
+    entry list never duplicate it.
+    """
+
+    __slots__ = ("items", "start", "stop")
+
+    def __init__(self, items: Sequence[str], start: int = 0, stop: Optional[int] = None) -> None:
+        if isinstance(items, Block):
+            start += items.start
+            stop = items.stop if stop is None else min(items.start + stop, items.stop)
+            items = items.items
+        self.items = items
+        self.start = start
+        self.stop = len(items) if stop is None else min(stop, len(items))
+
+    def __len__(self) -> int:
+        return max(0, self.stop - self.start)
+
+    @overload
+    def __getitem__(self, i: int) -> str: ...
+    @overload
+    def __getitem__(self, i: slice) -> Block: ...
+
+    def __getitem__(self, i: Union[int, slice]) -> Union[str, Block]:
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            if step != 1:
+                raise ValueError("Block slices do not support a step")
+            return Block(self.items, self.start + start, self.start + max(start, stop))
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("Block index out of range")
+        return self.items[self.start + i]
+
+    def __iter__(self) -> Iterator[str]:
+        return map(self.items.__getitem__, range(self.start, self.stop))
+
+    def __repr__(self) -> str:
+        return f"Block({self.start}:{self.stop} of {len(self.items)})"
+
+    @staticmethod
+    def join(parts: Sequence[Sequence[str]]) -> Optional[Block]:
+        """
+        One view over consecutive views of the same list, else None.
+        """
+        if not parts or not all(isinstance(p, Block) for p in parts):
+            return None
+        first = parts[0]
+        pos = first.start
+        for p in parts:
+            if p.items is not first.items or p.start != pos:
+                return None
+            pos = p.stop
+        return Block(first.items, first.start, pos)
+
+
+def chunk_list(items: Sequence[str], size: int) -> List[Block]:
     if size <= 0:
         raise ValueError("size must be > 0")
-    return [items[i:i+size] for i in range(0, len(items), size)]
\ No newline at end of file
+    return [Block(items, i, i + size) for i in range(0, len(items), size)]
+
+def hash_buckets(items: Sequence[str], buckets: int) -> List[List[str]]:
+    """
+    Spread items over a fixed number of buckets by a stable hash of each
+    entry, keeping their relative order. An entry stays in its bucket for as
+    long as the bucket count does not change.
+    """
+    if buckets <= 0:
+        raise ValueError("buckets must be > 0")
+    out: List[List[str]] = [[] for _ in range(buckets)]
+    for x in items:
+        out[zlib.crc32(x.encode()) % buckets].append(x)
+    return out
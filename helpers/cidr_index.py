@@ -0,0 +1,176 @@
+from __future__ import annotations
+import socket
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+from helpers import log
+from helpers.aggregate import merge_ranges
+from helpers.ipnum import format_prefix, parse_cidr, range_to_prefixes, split_ranges
+from helpers.ipset import IPSet
+from helpers.snapshot import has_ip_snapshot, load_ip_snapshots
+
+_V6_MASK = (1 << 128) - 1
+
+# conflicts resolved in this run, over all sources
+_resolved = 0
+
+
+class CIDRIndex:
+    """
+    Merged, sorted address ranges of some sources; tells in O(log n)
+    whether an address or prefix lies inside them.
+    """
+
+    def __init__(self, entries: Union[IPSet, Iterable[str]]) -> None:
+        if isinstance(entries, IPSet):
+            v4, v6 = entries.ranges()
+        else:
+            v4, v6, _ = split_ranges(entries)
+        r4 = merge_ranges(v4, 32)
+        self.v4_first = array("I", (f for f, _ in r4))
+        self.v4_last = array("I", (l for _, l in r4))
+        # IPv6 bounds do not fit an array type
+        r6 = merge_ranges(v6, 128)
+        self.v6_first = [f for f, _ in r6]
+        self.v6_last = [l for _, l in r6]
+
+    def __len__(self) -> int:
+        return len(self.v4_first) + len(self.v6_first)
+
+    def _ranges(self, version: int) -> Tuple[Sequence[int], Sequence[int]]:
+        if version == 4:
+            return self.v4_first, self.v4_last
+        return self.v6_first, self.v6_last
+
+    def _parse(self, entry: str) -> Optional[Tuple[int, int, int]]:
+        # fast path: bare IPv4 address, by far the most common entry
+        if "/" not in entry and ":" not in entry and entry.count(".") == 3:
+            try:
+                n = int.from_bytes(socket.inet_pton(socket.AF_INET, entry), "big")
+                return 4, n, n
+            except OSError:
+                pass
+        return parse_cidr(entry)
+
+    def _lookup(self, version: int, first: int, last: int) -> int:
+        """
+        → 1 if first..last lies inside the index, -1 if it partly
+        overlaps it, 0 if not at all.
+        """
+        firsts, lasts = self._ranges(version)
+        # merged ranges are disjoint: only the last one starting at or
+        # before 'last' can contain the entry, and if it ends before
+        # 'first' no range touches it
+        i = bisect_right(firsts, last) - 1
+        if i < 0 or lasts[i] < first:
+            return 0
+        return 1 if firsts[i] <= first and last <= lasts[i] else -1
+
+    def covers(self, entry: str) -> bool:
+        r = self._parse(entry)
+        return r is not None and self._lookup(*r) == 1
+
+    def _subtract(self, version: int, first: int, last: int) -> List[str]:
+        # the parts of first..last outside the index, as prefixes
+        bits = 32 if version == 4 else 128
+        firsts, lasts = self._ranges(version)
+        out: List[str] = []
+        cur = first
+        i = bisect_left(lasts, first)
+        while i < len(firsts) and firsts[i] <= last:
+            if cur < firsts[i]:
+                out.extend(format_prefix(version, n, p) for n, p in range_to_prefixes(cur, firsts[i] - 1, bits))
+            cur = lasts[i] + 1
+            i += 1
+        if cur <= last:
+            out.extend(format_prefix(version, n, p) for n, p in range_to_prefixes(cur, last, bits))
+        return out
+
+    def filter(self, entries: Iterable[str]) -> Tuple[List[str], int, int]:
+        """
+        → (entries outside the index, number dropped because they lie
+        inside, number cut down to the prefixes outside).
+        """
+        kept: List[str] = []
+        dropped = cut = 0
+        parse, lookup = self._parse, self._lookup
+        for e in entries:
+            r = parse(e)
+            hit = lookup(*r) if r is not None else 0
+            if hit == 0:
+                kept.append(e)
+            elif hit == 1:
+                dropped += 1
+            else:
+                cut += 1
+                kept.extend(self._subtract(*r))
+        return kept, dropped, cut
+
+    def filter_set(self, entries: IPSet) -> Tuple[IPSet, int, int]:
+        """
+        filter() on the packed entries of an IPSet, which stay packed:
+        → (the set without the entries inside the index and with those that
+        partly overlap it cut down, number dropped, number cut).
+        """
+        v4, v6 = entries.ranges()
+        lookup = self._lookup
+        hits = [lookup(4, r >> 32, r & 0xFFFFFFFF) for r in v4]
+        hits += [lookup(6, r >> 128, r & _V6_MASK) for r in v6]
+        if not any(hits):
+            return entries, 0, 0
+        pieces: List[str] = []
+        for i, hit in enumerate(hits):
+            if hit == -1:
+                version, r, bits = (4, v4[i], 32) if i < len(v4) else (6, v6[i - len(v4)], 128)
+                pieces.extend(self._subtract(version, r >> bits, r & ((1 << bits) - 1)))
+        # entries that are not addresses are never inside the index
+        kept = entries.subset([hit == 0 for hit in hits] + [True] * len(entries.other))
+        if pieces:
+            # pieces of a cut prefix may repeat entries it nested
+            kept = kept | IPSet.from_strings(pieces)
+        return kept, hits.count(1), hits.count(-1)
+
+
+def exclusion_sources(cfg: Dict[str, Any]) -> List[str]:
+    names = cfg.get("exclude_cidrs_from") or []
+    if isinstance(names, str):
+        names = [names]
+    return [str(n).strip() for n in names if n and str(n).strip()]
+
+
+def load_exclusion_index(name: str, cfg: Dict[str, Any]) -> Optional[CIDRIndex]:
+    """
+    Index of the last pushed entries of the sources in 'exclude_cidrs_from',
+    or None if the source has none.
+    """
+    names = exclusion_sources(cfg)
+    if not names:
+        return None
+    for n in names:
+        if not has_ip_snapshot(n):
+            log.warning("%s: exclude_cidrs_from: no snapshot of '%s' yet — ignored", name, n)
+
+    index = CIDRIndex(load_ip_snapshots(names))
+    log.debug("%s: %d ranges to exclude from %s", name, len(index), ", ".join(names))
+    return index
+
+
+def apply_exclusion(label: str, index: Optional[CIDRIndex], entries: IPSet) -> IPSet:
+    """
+    Drop the entries that lie inside the index, cut those that partly
+    overlap it down to the prefixes outside, and log the conflicts.
+    """
+    global _resolved
+    if index is None or not index:
+        return entries
+    kept, dropped, cut = index.filter_set(entries)
+    if dropped or cut:
+        _resolved += dropped + cut
+        log.info("%s: %d conflicts with exclude_cidrs_from resolved (%d dropped, %d cut down)",
+                 label, dropped + cut, dropped, cut)
+    return kept
+
+
+def resolved_conflicts() -> int:
+    return _resolved
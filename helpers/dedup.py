@@ -1,4 +1,34 @@
 from typing import Iterable, List
 
+from helpers import log
+from helpers.ipset import IPSet, IPSetBuilder
+
+
 def dedup_cidrs(cidrs: Iterable[str]) -> List[str]:
-    return sorted(set(cidrs))
\ No newline at end of file
+    return IPSet.from_strings(cidrs).to_list()
+
+
+def log_normalized(label: str, builder: IPSetBuilder, kept: int) -> None:
+    """
+    Counters of a built IPSetBuilder: rewritten, dropped and duplicate entries.
+    """
+    if builder.invalid:
+        log.warning("%s: %d invalid entries dropped", label, builder.invalid)
+    dupes = builder.total - builder.invalid - kept
+    msg = "%s: normalized %d entries → %d (%d rewritten, %d invalid, %d duplicates)"
+    if builder.rewritten or builder.invalid or dupes:
+        log.info(msg, label, builder.total, kept, builder.rewritten, builder.invalid, dupes)
+    else:
+        log.debug(msg, label, builder.total, kept, 0, 0, 0)
+
+
+def normalize_cidrs(label: str, entries: Iterable[str]) -> IPSet:
+    """
+    Canonical, valid and unique entries as an IPSet; entries that are not
+    addresses or prefixes are dropped and counted.
+    """
+    b = IPSetBuilder(keep_invalid=False)
+    b.update(entries)
+    s = b.build()
+    log_normalized(label, b, len(s))
+    return s
@@ -0,0 +1,189 @@
+from __future__ import annotations
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:  # urllib3 only decodes brotli when one of these is installed
+    import brotli  # noqa: F401
+    _ENCODINGS = "gzip, deflate, br"
+except ImportError:
+    try:
+        import brotlicffi  # noqa: F401
+        _ENCODINGS = "gzip, deflate, br"
+    except ImportError:
+        _ENCODINGS = "gzip, deflate"
+
+from helpers.raw_cache import CHUNK_SIZE, last_processed, record_processed, store_raw
+from config.credentials import settings
+
+VALIDATOR_PREFIX = "http:"
+
+_session: requests.Session | None = None
+_session_lock = threading.Lock()
+# validators of responses not yet processed: url -> {"etag": ..., "last_modified": ...}
+_pending: Dict[str, Dict[str, str]] = {}
+# raw payloads not yet processed: key -> digest
+_pending_raw: Dict[str, str] = {}
+# --replay: payloads come from the raw cache, upstreams are never contacted
+_replay = False
+# the same for one source, on the thread that rebuilds it (see from_cache)
+_local = threading.local()
+
+
+def set_replay(on: bool) -> None:
+    global _replay
+    _replay = on
+
+
+def replaying() -> bool:
+    return _replay
+
+
+@contextmanager
+def from_cache() -> Iterator[None]:
+    """
+    Within the block this thread reads every payload from the raw cache
+    (fetched in this run, else the last processed one) without contacting
+    upstreams, as in replay mode.
+    """
+    _local.cached = True
+    try:
+        yield
+    finally:
+        _local.cached = False
+
+
+def reading_cache() -> bool:
+    return _replay or getattr(_local, "cached", False)
+
+
+def get_session() -> requests.Session:
+    """
+    Shared keep-alive session for all upstream feeds (not SafeLine).
+    """
+    global _session
+    with _session_lock:
+        if _session is not None:
+            return _session
+        s = requests.Session()
+        retry = Retry(
+            total=3,
+            backoff_factor=0.5,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(["GET"]),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(max_retries=retry, pool_connections=16, pool_maxsize=16)
+        s.mount("http://", adapter)
+        s.mount("https://", adapter)
+        s.headers["Accept-Encoding"] = _ENCODINGS
+        _session = s
+        return s
+
+
+def conditional_get(url: str, state: Optional[Dict[str, Any]] = None, *,
+                    timeout: float = 20, **kwargs: Any) -> Optional[requests.Response]:
+    """
+    GET with If-None-Match / If-Modified-Since from the validators saved in
+    state. Returns None on 304 Not Modified. The new validators are only
+    kept in memory until commit_validators() is called, so a run that fails
+    after the download fetches the full body again next time.
+    """
+    headers = dict(kwargs.pop("headers", None) or {})
+    saved = state.get(VALIDATOR_PREFIX + url) if state is not None else None
+    if isinstance(saved, dict):
+        if saved.get("etag"):
+            headers["If-None-Match"] = saved["etag"]
+        if saved.get("last_modified"):
+            headers["If-Modified-Since"] = saved["last_modified"]
+
+    r = get_session().get(url, headers=headers, timeout=timeout, **kwargs)
+    if r.status_code == 304 and saved:
+        r.close()
+        return None
+    r.raise_for_status()
+
+    validators = {}
+    if r.headers.get("ETag"):
+        validators["etag"] = r.headers["ETag"]
+    if r.headers.get("Last-Modified"):
+        validators["last_modified"] = r.headers["Last-Modified"]
+    _pending[url] = validators
+    return r
+
+
+def commit_validators(state: Dict[str, Any], url: str) -> None:
+    """
+    Store the validators of the last response for url once it was processed.
+    """
+    validators = _pending.pop(url, None)
+    if validators is None:
+        return
+    if validators:
+        state[VALIDATOR_PREFIX + url] = validators
+    else:
+        state.pop(VALIDATOR_PREFIX + url, None)
+
+
+def replay_payload(state: Optional[Dict[str, Any]], key: str) -> str:
+    """
+    Digest of the payload for key fetched in this run, else of the last
+    processed one, for reading_cache() mode.
+    """
+    digest = _pending_raw.get(key) or last_processed(state or {}, key)
+    if digest is None:
+        raise RuntimeError(f"{key}: no cached payload to replay")
+    _pending_raw[key] = digest
+    return digest
+
+
+def fetch_raw(url: str, state: Optional[Dict[str, Any]] = None, *,
+              timeout: float = 20, **kwargs: Any) -> Optional[str]:
+    """
+    Download url into the raw cache and return the payload digest.
+    With state, returns None when the upstream answers 304 or sends the
+    same bytes as the last processed payload. In reading_cache() mode the
+    cached payload is returned without any request.
+    """
+    if reading_cache():
+        return replay_payload(state, url)
+    # validators only help if the payload they describe is still cached
+    cached = last_processed(state, url) if state is not None else None
+    r = conditional_get(url, state if cached else None, timeout=timeout, stream=True, **kwargs)
+    if r is None:
+        return None
+    try:
+        digest = store_raw(r.iter_content(chunk_size=CHUNK_SIZE))
+    finally:
+        r.close()
+    if digest == cached:
+        return None
+    _pending_raw[url] = digest
+    return digest
+
+
+def store_payload(key: str, state: Optional[Dict[str, Any]], chunks: Iterable[bytes]) -> Optional[str]:
+    """
+    Same as fetch_raw() for payloads that do not come from an HTTP GET
+    (e.g. whois answers).
+    """
+    digest = store_raw(chunks)
+    if state is not None and digest == last_processed(state, key):
+        return None
+    _pending_raw[key] = digest
+    return digest
+
+
+def commit_fetch(state: Dict[str, Any], key: str) -> None:
+    """
+    The payload fetched for key was processed: store its validators and
+    record it as the last processed payload.
+    """
+    commit_validators(state, key)
+    digest = _pending_raw.pop(key, None)
+    if digest is not None:
+        record_processed(state, key, digest, settings.RAW_CACHE_KEEP)
@@ -1,98 +1,188 @@
 from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
 from math import ceil
-from typing import Dict, Iterable, List, Optional, Literal
-import time
+from typing import Dict, List, NamedTuple, Optional, Literal, Sequence, Set, Tuple
+import threading
 
 from api.safeline import (
-    get_ip_group_id,
     create_ip_group,
     update_ip_group,
     append_ip_group,
-    delete_ip_group
+    delete_ip_group,
+    delete_ip_groups,
+    get_ip_group_ips,
+    groups_with_prefix,
+    MAX_CONCURRENCY
 )
+from api.rules import flush_rule_updates
 from helpers.group_name import format_group_name
-from helpers.chunks import chunk_list
+from helpers.chunks import Block, chunk_list, hash_buckets
+from helpers.pacing import FixedPacer, get_pacer, DEFAULT_MAX_BATCH_BYTES
+from helpers.snapshot import save_group_record, load_group_record, drop_group_record
+from helpers.fetch import replaying
+from helpers.hash import fingerprint_matches, set_fingerprint
 from helpers import log
 
-def stable_unique(seq: Iterable[str]) -> List[str]:
-    seen = set()
-    out: List[str] = []
-    for x in seq or []:
-        if x not in seen:
-            seen.add(x)
-            out.append(x)
-    return out
+# target fill of a bucket when the hash partitioning is (re)sized
+BUCKET_FILL = 0.8
+
+# state key of the per-group fingerprints: {group name: "<gid>:<digest of block>"}
+GROUP_FINGERPRINTS_KEY = "group_fingerprints"
+
+# groups of empty hash buckets in this run: they hold only the placeholder
+# and are left out of rules (see rules_sync.group_ids_for_range)
+_empty_groups: Set[int] = set()
+
+def empty_groups() -> Set[int]:
+    return _empty_groups
+
+def _mark_empty(gid: int, empty: bool) -> None:
+    if empty:
+        _empty_groups.add(gid)
+    else:
+        _empty_groups.discard(gid)
+
+def empty_group_indices(base_group_name: str, count: int) -> List[int]:
+    """
+    Indices of the groups up to '<base>-<count>' marked empty in this run,
+    to keep in the state for runs that do not push them.
+    """
+    empty = _empty_groups
+    return [idx for idx, gid in groups_with_prefix(base_group_name).items() if idx <= count and gid in empty]
 
 def required_group_count(total_items: int, max_per_group: int) -> int:
     if total_items <= 0:
         return 0
     return ceil(total_items / max_per_group)
 
-def ensure_group(group_name: str, placeholder_ip: List[str]) -> Optional[int]:
-    gid = get_ip_group_id(group_name)
-    if gid is not None:
-        return gid
-    try:
-        gid = create_ip_group(group_name, placeholder_ip)
-        log.info("Group '%s' created (ID %s).", group_name, gid)
-        return gid
-    except Exception as e:
-        log.error("Could not create group '%s': %s", group_name, e)
-        return None
-
-def ensure_required_groups(base_group_name: str, count: int,
-                           placeholder_ip: List[str]) -> Dict[int, int]:
-    idx_to_gid: Dict[int, int] = {}
-    for idx in range(1, count + 1):
-        gname = format_group_name(base_group_name, idx)
-        gid = ensure_group(gname, placeholder_ip)
-        if gid is not None:
-            idx_to_gid[idx] = gid
-        else:
-            log.warning("Missing group '%s' (create failed) — will skip its block.", gname)
-    return idx_to_gid
+def partition_entries(entries: List[str], base_group_name: str, max_per_group: int,
+                      strategy: str = "slice") -> List[Sequence[str]]:
+    """
+    'slice' cuts the list into consecutive blocks of max_per_group (views,
+    not copies).
+    'hash' assigns entries to buckets by hash, keeping the number of groups
+    that already exist; the bucket count changes only when a bucket would
+    exceed max_per_group or when the groups are less than half needed.
+    """
+    if strategy != "hash":
+        return chunk_list(entries, max_per_group)
 
-def upload_replace(group_name: str, group_id: int, items: List[str]) -> None:
-    update_ip_group(group_name, group_id, items)
-    log.info("[REPLACE] %s: set %d entries", group_name, len(items))
+    total = len(entries)
+    target = max(1, ceil(total / (max_per_group * BUCKET_FILL)))
+    existing = len(groups_with_prefix(base_group_name))
+    buckets = existing if existing and existing < 2 * target else target
+    blocks = hash_buckets(entries, buckets)
+    while max(len(b) for b in blocks) > max_per_group:
+        buckets = max(buckets + 1, target)
+        blocks = hash_buckets(entries, buckets)
+    if buckets != existing:
+        log.info("%s: hash partitioning over %d groups (was %d)", base_group_name, buckets, existing)
+    return blocks
 
-def upload_hybrid(
-    group_name: str,
-    group_id: int,
-    items: List[str],
+class GroupOp(NamedTuple):
+    action: Literal["create", "replace", "append"]
+    items: Sequence[str]
+
+def _append_ops(items: Block, start: int, sizer: FixedPacer,
+                max_batch_bytes: Optional[int]) -> List[GroupOp]:
+    ops: List[GroupOp] = []
+    pos = start
+    while pos < len(items):
+        end = sizer.take(items, pos, max_bytes=max_batch_bytes)
+        ops.append(GroupOp("append", items[pos:end]))
+        pos = end
+    return ops
+
+def plan_group_upload(
+    items: Sequence[str],
     *,
+    exists: bool,
+    current: Optional[Set[str]] = None,
     initial_batch_size: int,
     append_batch_size: int,
-    sleep_between: float,
-) -> None:
-    items = stable_unique(items)
-    if not items:
-        log.debug("%s: no entries.", group_name)
-        return
+    max_batch_bytes: Optional[int] = None,
+    sizer: Optional[FixedPacer] = None,
+) -> List[GroupOp]:
+    """
+    Smallest sequence of requests that leaves one group holding 'items'.
+    A missing group is created with its first batch as content; an existing
+    one is replaced with its first batch (never reset to an empty list
+    first); when 'current' is known and nothing has to be removed, only the
+    additions are appended, and an unchanged group needs no request.
+    The batches are views of 'items', cut by 'sizer' (the pacer that will
+    send them) or else by append_batch_size.
+    """
+    sizer = sizer or FixedPacer(append_batch_size, 0)
+    if exists and current is not None:
+        wanted = set(items)
+        if all(x in wanted for x in current):
+            return _append_ops(Block([x for x in items if x not in current]), 0, sizer, max_batch_bytes)
 
-    first = items[:initial_batch_size] if initial_batch_size > 0 else []
-    if first:
-        update_ip_group(group_name, group_id, first)
-        log.info("[UPDATE] %s: initial %d entries (replace)", group_name, len(first))
-    else:
-        update_ip_group(group_name, group_id, [])
-        log.info("[UPDATE] %s: reset to %d entries", group_name, 0)
+    items = Block(items)
+    head = initial_batch_size if initial_batch_size > 0 else append_batch_size
+    first_end = sizer.take(items, 0, head, max_batch_bytes)
+    first = GroupOp("replace" if exists else "create", items[:first_end])
+    return [first] + _append_ops(items, first_end, sizer, max_batch_bytes)
 
-    rest = items[len(first):]
-    if not rest:
-        return
+def execute_group_plan(
+    group_name: str,
+    group_id: Optional[int],
+    ops: List[GroupOp],
+    *,
+    pacer: FixedPacer,
+    max_batch_bytes: Optional[int] = None,
+) -> Tuple[Optional[int], int]:
+    """
+    Runs a plan from plan_group_upload. Appends are re-batched by the pacer;
+    planned with the same pacer, the counts differ only if it adapted in
+    between.
+    Returns (group id, number of requests sent).
+    """
+    executed = 0
+    appends: List[Sequence[str]] = []
+    for op in ops:
+        if op.action == "create":
+            group_id = pacer.call(create_ip_group, group_name, op.items)
+            executed += 1
+            log.info("[CREATE] %s: created with %d entries (ID %s)", group_name, len(op.items), group_id)
+        elif op.action == "replace":
+            pacer.call(update_ip_group, group_name, group_id, op.items)
+            executed += 1
+            log.info("[UPDATE] %s: initial %d entries (replace)", group_name, len(op.items))
+        else:
+            appends.append(op.items)
+    if appends:
+        # planned appends are consecutive views of one list: re-batch them in place
+        items = Block.join(appends) or Block([x for a in appends for x in a])
+        executed += _append_all(group_name, group_id, items, 0, pacer, max_batch_bytes)
+    return group_id, executed
 
-    if append_ip_group is None:
-        update_ip_group(group_name, group_id, items)
-        log.warning("[FALLBACK] %s: no append endpoint → full replace (%d)", group_name, len(items))
-        return
+def _append_all(group_name: str, group_id: int, items: Sequence[str], start: int,
+                pacer: FixedPacer, max_batch_bytes: Optional[int]) -> int:
+    items = Block(items)
+    pos = start
+    batch = 0
+    while pos < len(items):
+        end = pacer.take(items, pos, max_bytes=max_batch_bytes)
+        chunk = items[pos:end]
+        pacer.call(append_ip_group, group_id, chunk)
+        batch += 1
+        log.info("[APPEND] %s: +%d (batch %d)", group_name, len(chunk), batch)
+        pos = end
+        pacer.pause()
+    return batch
 
-    for i in range(0, len(rest), append_batch_size):
-        chunk = rest[i: i + append_batch_size]
-        append_ip_group(group_id, chunk)
-        log.info("[APPEND] %s: +%d (batch %d)", group_name, len(chunk), i // append_batch_size + 1)
-        if sleep_between > 0:
-            time.sleep(sleep_between)
+def current_group_entries(group_id: int) -> Optional[Set[str]]:
+    """
+    What the group holds now: the local record of the last push, else the
+    contents from the server listing. None if neither is known. Replay mode
+    trusts the server only (it may have been restored from a backup).
+    """
+    current = None if replaying() else load_group_record(group_id)
+    if current is not None:
+        return current
+    ips = get_ip_group_ips(group_id)
+    return set(ips) if ips is not None else None
 
 CleanupAction = Literal["delete", "placeholder", "clear", "keep"]
 
@@ -103,22 +193,41 @@ def cleanup_extra_groups(
     previous_count: int,
     action: str = "placeholder",
     placeholder_ip: str = "192.0.2.1",
+    fingerprints: Optional[Dict[str, str]] = None,
 ) -> None:
-    from api.safeline import count_groups_with_prefix, update_ip_group
+    """
+    Handles every '<base>-NNN' group above used_count, gaps included, found
+    in one listing. 'delete' removes them all with a single request;
+    'placeholder' and 'clear' are sent concurrently.
+    """
+    surplus = {idx: gid for idx, gid in groups_with_prefix(base_group_name).items() if idx > used_count}
+    if not surplus:
+        log.info("[CLEANUP] %s: nothing to clean (used=%d)", base_group_name, used_count)
+        return
 
-    actual_count = count_groups_with_prefix(base_group_name)
-    if actual_count <= used_count:
-        log.info("[CLEANUP] %s: nothing to clean (actual=%d, used=%d)", base_group_name, actual_count, used_count)
+    log.info("[CLEANUP] %s: %d extra groups found (action=%s)", base_group_name, len(surplus), action)
+    if action not in ("delete", "placeholder", "clear"):
+        log.debug("%s: cleanup action '%s' — groups left as they are", base_group_name, action)
         return
 
-    log.info("[CLEANUP] %s: %d extra groups found (action=%s)", base_group_name, actual_count - used_count, action)
+    for idx, gid in surplus.items():
+        if fingerprints is not None:
+            fingerprints.pop(format_group_name(base_group_name, idx), None)
+        drop_group_record(gid)
 
-    for idx in range(used_count + 1, actual_count + 1):
-        gname = f"{base_group_name}-{idx:03d}"
-        gid = get_ip_group_id(gname)
-        if gid is None:
-            continue
+    if action == "delete":
+        # rules must stop referencing the surplus groups before they can go
+        flush_rule_updates()
+        try:
+            delete_ip_groups(list(surplus.values()))
+            for idx, gid in surplus.items():
+                log.info("[DELETE] '%s' (ID %s) removed", format_group_name(base_group_name, idx), gid)
+            return
+        except Exception as e:
+            log.warning("[CLEANUP] %s: bulk delete failed (%s) — deleting one by one", base_group_name, e)
 
+    def clean(idx: int, gid: int) -> None:
+        gname = format_group_name(base_group_name, idx)
         try:
             if action == "delete":
                 delete_ip_group(gid)
@@ -126,14 +235,16 @@ def cleanup_extra_groups(
             elif action == "placeholder":
                 update_ip_group(gname, gid, [placeholder_ip])
                 log.info("[PLACEHOLDER] '%s' (ID %s) set to %s", gname, gid, placeholder_ip)
-            elif action == "clear":
+            else:
                 update_ip_group(gname, gid, [])
                 log.info("[CLEAR] '%s' (ID %s) cleared", gname, gid)
-            else:
-                log.debug("'%s': unknown action '%s'", gname, action)
         except Exception as e:
             log.warning("cleanup '%s' failed: %s", gname, e)
 
+    with ThreadPoolExecutor(max_workers=min(MAX_CONCURRENCY, len(surplus)), thread_name_prefix="cleanup") as pool:
+        for idx, gid in surplus.items():
+            pool.submit(clean, idx, gid)
+
 def upsert_grouped_entries(
     *,
     entries: List[str],
@@ -142,35 +253,131 @@ def upsert_grouped_entries(
     initial_batch_size: int,
     append_batch_size: int,
     sleep_between_batches: float,
-    placeholder_ip: str
+    placeholder_ip: str,
+    concurrency: int = 1,
+    pacing: str = "adaptive",
+    max_batch_bytes: int = DEFAULT_MAX_BATCH_BYTES,
+    delta: bool = False,
+    fingerprints: Optional[Dict[str, str]] = None,
+    partition: str = "slice"
 ) -> int:
-    entries = stable_unique(entries)
+    """
+    Each group is planned with plan_group_upload (missing groups are created
+    with their first batch) and the planned/executed request counts are
+    logged.
+    With concurrency > 1 the groups are pushed by that many workers; each
+    group is still uploaded by a single worker (replace first, then appends).
+    pacing="adaptive" lets an AdaptivePacer, seeded with append_batch_size /
+    sleep_between_batches, tune batch sizes and delays; "fixed" keeps them.
+    delta=True sends only the changes against each group's known contents
+    and keeps a local record of what was pushed.
+    With a fingerprints dict (usually state[GROUP_FINGERPRINTS_KEY]), groups
+    whose block matches the last successful push are skipped.
+    partition selects how entries are spread over groups (partition_entries).
+    'entries' must already be unique (e.g. IPSet.to_list());
+    groups and batches are views of it, copied only as each request is sent.
+    Returns the number of groups planned, '<base>-001' up to it. If any
+    group fails, the others are still pushed, but a RuntimeError is raised
+    and no fingerprint of this push is written.
+    """
     total = len(entries)
     if total == 0:
         log.info("%s: no entries to patch.", base_group_name)
         return 0
 
-    blocks = chunk_list(entries, max_per_group)
-    needed = required_group_count(total, max_per_group)
-    idx_to_gid = ensure_required_groups(base_group_name, needed, [placeholder_ip])
+    blocks = partition_entries(entries, base_group_name, max_per_group, partition)
+    # an empty hash bucket keeps its group, so entries need not move when it
+    # fills again; the group is set to the placeholder (a constant block, so
+    # its fingerprint is stable while the bucket stays empty) and left out
+    # of the rule
+    empty = {idx for idx, b in enumerate(blocks, start=1) if not b}
+    blocks = [b or [placeholder_ip] for b in blocks]
+    existing = groups_with_prefix(base_group_name)
+
+    if pacing == "adaptive":
+        pacer = get_pacer(append_batch_size, sleep_between_batches)
+    else:
+        pacer = FixedPacer(append_batch_size, sleep_between_batches)
+    counts = {"planned": 0, "executed": 0}
+    counts_lock = threading.Lock()
+    # fingerprints of this push, written only once every group went through
+    pushed: Dict[str, str] = {}
 
-    used = 0
-    for idx, block in enumerate(blocks, start=1):
+    def push(idx: int, block: Sequence[str]) -> None:
         gname = format_group_name(base_group_name, idx)
-        gid = idx_to_gid.get(idx)
-        if gid is None:
-            log.debug("%s: missing group id — skip %d entries.", gname, len(block))
-            continue
-
-        log.info("[GROUP] %s: %d entries (block %d/%d)", gname, len(block), idx, len(blocks))
-        upload_hybrid(
-            group_name=gname,
-            group_id=gid,
-            items=block,
+        gid = existing.get(idx)
+        digest = set_fingerprint(block) if fingerprints is not None else None
+        prev_gid, _, prev_digest = (fingerprints or {}).get(gname, "").partition(":")
+        if (gid is not None and digest is not None and not replaying()
+                and prev_gid == str(gid) and fingerprint_matches(prev_digest or None, digest, block)):
+            pushed[gname] = f"{gid}:{digest}"
+            _mark_empty(gid, idx in empty)
+            log.info("[GROUP] %s: unchanged (%d entries) — skip.", gname, len(block))
+            return
+
+        current = current_group_entries(gid) if delta and gid is not None else None
+        ops = plan_group_upload(
+            block,
+            exists=gid is not None,
+            current=current,
             initial_batch_size=initial_batch_size,
             append_batch_size=append_batch_size,
-            sleep_between=sleep_between_batches,
+            max_batch_bytes=max_batch_bytes,
+            sizer=pacer,
         )
-        used += 1
+        if not ops:
+            log.info("[DELTA] %s: unchanged (%d entries)", gname, len(block))
+        else:
+            log.info("[GROUP] %s: %d entries (block %d/%d, %d requests planned)",
+                     gname, len(block), idx, len(blocks), len(ops))
+            if gid is not None:
+                # until the whole plan went through no record describes the
+                # group: a failed append batch leaves it partly appended
+                drop_group_record(gid)
+            if fingerprints is not None:
+                # likewise the fingerprint of the last push
+                fingerprints.pop(gname, None)
+            try:
+                gid, executed = execute_group_plan(gname, gid, ops, pacer=pacer,
+                                                   max_batch_bytes=max_batch_bytes)
+            except Exception as e:
+                log.error("[GROUP] %s: upload failed: %s", gname, e)
+                raise
+            with counts_lock:
+                counts["planned"] += len(ops)
+                counts["executed"] += executed
+
+        if delta:
+            save_group_record(gid, block)
+        if digest is not None:
+            pushed[gname] = f"{gid}:{digest}"
+        _mark_empty(gid, idx in empty)
+        if idx in empty:
+            log.info("[GROUP] %s: empty bucket — placeholder only, left out of the rule", gname)
+
+    def attempt(idx: int, block: Sequence[str]) -> Optional[Exception]:
+        try:
+            push(idx, block)
+            return None
+        except Exception as e:
+            return e
+
+    # every block is attempted; one that fails fails the whole source, so
+    # the caller leaves rules, surplus groups and state as they were
+    jobs = list(enumerate(blocks, start=1))
+    workers = min(max(1, int(concurrency or 1)), len(jobs))
+    if workers <= 1:
+        errors = [attempt(idx, block) for idx, block in jobs]
+    else:
+        log.info("%s: pushing %d groups with %d workers", base_group_name, len(jobs), workers)
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="push") as pool:
+            errors = list(pool.map(lambda job: attempt(*job), jobs))
+    failed = [e for e in errors if e is not None]
+    if failed:
+        raise RuntimeError(f"{base_group_name}: {len(failed)} of {len(jobs)} groups failed — "
+                           f"rule, cleanup and state left as they were: {failed[0]}") from failed[0]
 
-    return used
\ No newline at end of file
+    if fingerprints is not None:
+        fingerprints.update(pushed)
+    log.info("%s: %d requests planned, %d executed", base_group_name, counts["planned"], counts["executed"])
+    return len(blocks)
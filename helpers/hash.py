@@ -1,7 +1,77 @@
-from typing import Iterable
+from typing import Iterable, Optional
 import hashlib, json
 
+# set fingerprints: "v2:<count>:<sum>:<xor>" of 64-bit per-entry hashes
+FINGERPRINT_PREFIX = "v2:"
+_MASK64 = (1 << 64) - 1
+
+
 def _hash_list(values: Iterable[str]) -> str:
+    """
+    Legacy fingerprint (sorted JSON + SHA-256); only used to recognise
+    hashes stored by older versions.
+    """
     normalized = sorted(values)
     h = hashlib.sha256(json.dumps(normalized, ensure_ascii=False).encode("utf-8"))
-    return h.hexdigest()
\ No newline at end of file
+    return h.hexdigest()
+
+
+def config_digest(cfg: object) -> str:
+    """
+    Short digest of a config mapping, independent of key order.
+    """
+    data = json.dumps(cfg, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.blake2b(data.encode("utf-8"), digest_size=8).hexdigest()
+
+
+class SetFingerprint:
+    """
+    Order-independent fingerprint of a set of strings, fed one entry at a
+    time; the caller makes sure entries are unique.
+    """
+
+    __slots__ = ("count", "total", "xor")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0
+        self.xor = 0
+
+    def add(self, value: str) -> None:
+        h = int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "little")
+        self.count += 1
+        self.total += h
+        self.xor ^= h
+
+    def update(self, values: Iterable[str]) -> None:
+        blake2b = hashlib.blake2b
+        from_bytes = int.from_bytes
+        count, total, xor = self.count, self.total, self.xor
+        for v in values:
+            h = from_bytes(blake2b(v.encode("utf-8"), digest_size=8).digest(), "little")
+            count += 1
+            total += h
+            xor ^= h
+        self.count, self.total, self.xor = count, total, xor
+
+    def hexdigest(self) -> str:
+        return f"{FINGERPRINT_PREFIX}{self.count}:{self.total & _MASK64:016x}:{self.xor:016x}"
+
+
+def set_fingerprint(values: Iterable[str]) -> str:
+    fp = SetFingerprint()
+    fp.update(values)
+    return fp.hexdigest()
+
+
+def fingerprint_matches(prev: Optional[str], new: str, values: Iterable[str]) -> bool:
+    """
+    prev (from the state) describes the same set as new. A legacy
+    _hash_list() value is checked against values once, so upgrading does
+    not count as a change.
+    """
+    if prev is None:
+        return False
+    if prev.startswith(FINGERPRINT_PREFIX):
+        return prev == new
+    return prev == _hash_list(values)
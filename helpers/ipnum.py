@@ -0,0 +1,104 @@
+from __future__ import annotations
+import socket
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+# (first, last) address of a prefix or range, both inclusive
+Range = Tuple[int, int]
+
+_BITS = {4: 32, 6: 128}
+_FAMILY = {4: socket.AF_INET, 6: socket.AF_INET6}
+
+
+def parse_cidr(entry: str) -> Optional[Tuple[int, int, int]]:
+    """
+    'a.b.c.d', 'a.b.c.d/n' or the IPv6 forms → (version, first, last).
+    Host bits of a CIDR are ignored. None if the entry is not an address.
+    """
+    addr, sep, plen = entry.strip().partition("/")
+    version = 6 if ":" in addr else 4
+    try:
+        n = int.from_bytes(socket.inet_pton(_FAMILY[version], addr), "big")
+    except (OSError, ValueError):
+        return None
+    bits = _BITS[version]
+    if not sep:
+        return version, n, n
+    try:
+        p = int(plen)
+    except ValueError:
+        return None
+    if not 0 <= p <= bits:
+        return None
+    host = (1 << (bits - p)) - 1
+    return version, n & ~host, n | host
+
+
+def parse_prefix(entry: str) -> Optional[Tuple[int, int, int]]:
+    """
+    Like parse_cidr(), but → (version, network, prefix length); a bare
+    address has the full length.
+    """
+    r = parse_cidr(entry)
+    if r is None:
+        return None
+    version, first, last = r
+    return version, first, _BITS[version] - (last - first).bit_length()
+
+
+def split_ranges(entries: Iterable[str]) -> Tuple[List[int], List[int], List[str]]:
+    """
+    IPv4 and IPv6 ranges packed as single ints (first << bits | last, so a
+    plain sort orders them by start), plus the entries that did not parse.
+    """
+    v4: List[int] = []
+    v6: List[int] = []
+    invalid: List[str] = []
+    pton = socket.inet_pton
+    af = socket.AF_INET
+    from_bytes = int.from_bytes
+    for e in entries:
+        # fast path: bare IPv4 address, by far the most common entry
+        # (inet_pton, unlike inet_aton, rejects octal and short forms)
+        if "/" not in e and ":" not in e and e.count(".") == 3:
+            try:
+                n = from_bytes(pton(af, e), "big")
+                v4.append(n << 32 | n)
+                continue
+            except OSError:
+                pass
+        r = parse_cidr(e)
+        if r is None:
+            invalid.append(e)
+        elif r[0] == 4:
+            v4.append(r[1] << 32 | r[2])
+        else:
+            v6.append(r[1] << 128 | r[2])
+    return v4, v6, invalid
+
+
+def range_to_prefixes(first: int, last: int, bits: int, min_prefix: int = 0) -> Iterator[Tuple[int, int]]:
+    """
+    Smallest list of (network, prefix length) covering exactly first..last,
+    with no prefix shorter than min_prefix.
+    """
+    if first == last:
+        yield first, bits
+        return
+    max_host = bits - min_prefix
+    while first <= last:
+        align = (first & -first).bit_length() - 1 if first else bits
+        span = (last - first + 1).bit_length() - 1
+        host = min(align, span, max_host)
+        yield first, bits - host
+        first += 1 << host
+
+
+def format_prefix(version: int, network: int, plen: int) -> str:
+    """
+    Single addresses without '/32' or '/128', like the feeds send them.
+    """
+    if version == 4 and plen == 32:
+        return socket.inet_ntoa(network.to_bytes(4, "big"))
+    bits = _BITS[version]
+    addr = socket.inet_ntop(_FAMILY[version], network.to_bytes(bits // 8, "big"))
+    return addr if plen == bits else f"{addr}/{plen}"
@@ -0,0 +1,237 @@
+from __future__ import annotations
+import socket
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import compress
+from typing import Any, Iterable, Iterator, List, Sequence, Tuple
+
+from helpers.ipnum import format_prefix, parse_prefix
+
+# IPv4 entries are packed as network << 6 | prefix length into one uint64,
+# IPv6 entries as a (hi, lo) uint64 pair of the network plus a uint8 prefix
+# length. Sorting the packed values orders entries numerically, so every
+# set below is a sorted, duplicate-free array. Entries that are not
+# addresses are carried along as strings.
+_V6_LO = (1 << 64) - 1
+_AF_INET = socket.AF_INET
+_pton = socket.inet_pton
+
+
+_END = object()
+
+
+def _merge(a: Iterable[Any], b: Iterable[Any], keep_a: bool, keep_both: bool, keep_b: bool) -> Iterator[Any]:
+    """
+    One pass over two sorted, duplicate-free sequences: yields, in order,
+    the items only in a, in both, and only in b, as selected.
+    """
+    ia, ib = iter(a), iter(b)
+    x, y = next(ia, _END), next(ib, _END)
+    while x is not _END and y is not _END:
+        if x < y:
+            if keep_a:
+                yield x
+            x = next(ia, _END)
+        elif y < x:
+            if keep_b:
+                yield y
+            y = next(ib, _END)
+        else:
+            if keep_both:
+                yield x
+            x, y = next(ia, _END), next(ib, _END)
+    if keep_a and x is not _END:
+        yield x
+        yield from ia
+    if keep_b and y is not _END:
+        yield y
+        yield from ib
+
+
+class IPSetBuilder:
+    """
+    Collects entries in arrival order, duplicates included; build() sorts
+    and deduplicates once. Entries are stored canonical (host bits cleared,
+    hosts without /32 or /128, compressed IPv6); 'rewritten' counts those
+    that were not. Entries that are not addresses are counted in 'invalid'
+    and kept only with keep_invalid.
+    """
+
+    def __init__(self, keep_invalid: bool = True) -> None:
+        self._v4 = array("Q")
+        self._v6: List[int] = []
+        self._other: List[str] = []
+        self.keep_invalid = keep_invalid
+        self.invalid = 0
+        self.rewritten = 0
+        self.total = 0
+
+    def add(self, entry: str) -> None:
+        # fast path: bare IPv4 address, by far the most common entry
+        # (inet_pton, unlike inet_aton, rejects octal and short forms)
+        if "/" not in entry and ":" not in entry and entry.count(".") == 3:
+            try:
+                self._v4.append(int.from_bytes(_pton(_AF_INET, entry), "big") << 6 | 32)
+                return
+            except OSError:
+                pass
+        r = parse_prefix(entry)
+        if r is None:
+            self.invalid += 1
+            if self.keep_invalid:
+                self._other.append(entry)
+            return
+        version, net, plen = r
+        if format_prefix(version, net, plen) != entry:
+            self.rewritten += 1
+        if version == 4:
+            self._v4.append(net << 6 | plen)
+        else:
+            self._v6.append(net << 8 | plen)
+
+    def update(self, entries: Iterable[str]) -> None:
+        add = self.add
+        for e in entries:
+            add(e)
+
+    def build(self) -> IPSet:
+        self.total = len(self._v4) + len(self._v6) + self.invalid
+        v4 = array("Q", sorted(set(self._v4)))
+        self._v4 = array("Q")
+        out = IPSet._from_keys(v4, sorted(set(self._v6)), sorted(set(self._other)))
+        self._v6 = []
+        self._other = []
+        return out
+
+
+class IPSet:
+    """
+    Immutable, sorted set of addresses and CIDRs in packed arrays (or
+    read-only views of the same layout, see helpers.snapshot). Strings are
+    only produced when iterating (numeric order, IPv4 first, hosts without
+    /32 or /128).
+    """
+
+    __slots__ = ("v4", "v6_hi", "v6_lo", "v6_plen", "other")
+
+    def __init__(self) -> None:
+        self.v4 = array("Q")
+        self.v6_hi = array("Q")
+        self.v6_lo = array("Q")
+        self.v6_plen = array("B")
+        self.other: Tuple[str, ...] = ()
+
+    @classmethod
+    def _from_keys(cls, v4: array, v6: Iterable[int], other: Iterable[str]) -> IPSet:
+        s = cls()
+        s.v4 = v4
+        for key in v6:
+            net = key >> 8
+            s.v6_hi.append(net >> 64)
+            s.v6_lo.append(net & _V6_LO)
+            s.v6_plen.append(key & 0xFF)
+        s.other = tuple(other)
+        return s
+
+    @classmethod
+    def from_strings(cls, entries: Iterable[str]) -> IPSet:
+        b = IPSetBuilder()
+        b.update(entries)
+        return b.build()
+
+    def _v6(self) -> Iterator[Tuple[int, int, int]]:
+        return zip(self.v6_hi, self.v6_lo, self.v6_plen)
+
+    def _find_v6(self, hi: int, lo: int, plen: int) -> bool:
+        # entries are sorted by (hi, lo, plen): narrow down one field at a time
+        i = bisect_left(self.v6_hi, hi)
+        j = bisect_right(self.v6_hi, hi, i)
+        i = bisect_left(self.v6_lo, lo, i, j)
+        j = bisect_right(self.v6_lo, lo, i, j)
+        i = bisect_left(self.v6_plen, plen, i, j)
+        return i < j and self.v6_plen[i] == plen
+
+    def __len__(self) -> int:
+        return len(self.v4) + len(self.v6_plen) + len(self.other)
+
+    def __bool__(self) -> bool:
+        return len(self) > 0
+
+    def __iter__(self) -> Iterator[str]:
+        for key in self.v4:
+            yield format_prefix(4, key >> 6, key & 0x3F)
+        for h, l, p in self._v6():
+            yield format_prefix(6, h << 64 | l, p)
+        yield from self.other
+
+    def __contains__(self, entry: object) -> bool:
+        if not isinstance(entry, str):
+            return False
+        r = parse_prefix(entry)
+        if r is None:
+            return entry in self.other
+        version, net, plen = r
+        if version == 6:
+            return self._find_v6(net >> 64, net & _V6_LO, plen)
+        key = net << 6 | plen
+        i = bisect_left(self.v4, key)
+        return i < len(self.v4) and self.v4[i] == key
+
+    def to_list(self) -> List[str]:
+        return list(self)
+
+    def subset(self, keep: Sequence[bool]) -> IPSet:
+        """
+        The entries whose flag in 'keep' (one per entry, in iteration
+        order) is set.
+        """
+        n4, n6 = len(self.v4), len(self.v6_plen)
+        k6 = keep[n4:n4 + n6]
+        s = IPSet()
+        s.v4 = array("Q", compress(self.v4, keep[:n4]))
+        s.v6_hi = array("Q", compress(self.v6_hi, k6))
+        s.v6_lo = array("Q", compress(self.v6_lo, k6))
+        s.v6_plen = array("B", compress(self.v6_plen, k6))
+        s.other = tuple(compress(self.other, keep[n4 + n6:]))
+        return s
+
+    def ranges(self) -> Tuple[List[int], List[int]]:
+        """
+        IPv4 and IPv6 entries packed as ranges like ipnum.split_ranges().
+        """
+        v4 = []
+        for key in self.v4:
+            net, host = key >> 6, (1 << (32 - (key & 0x3F))) - 1
+            v4.append(net << 32 | net | host)
+        v6 = []
+        for h, l, p in self._v6():
+            net, host = h << 64 | l, (1 << (128 - p)) - 1
+            v6.append(net << 128 | net | host)
+        return v4, v6
+
+    # -- set algebra (exact entries, not address coverage) ---------------------
+
+    def _combine(self, other: IPSet, keep: Tuple[bool, bool, bool]) -> IPSet:
+        # both sides are sorted: merge the packed arrays in one pass
+        s = IPSet()
+        s.v4 = array("Q", _merge(self.v4, other.v4, *keep))
+        for h, l, p in _merge(self._v6(), other._v6(), *keep):
+            s.v6_hi.append(h)
+            s.v6_lo.append(l)
+            s.v6_plen.append(p)
+        s.other = tuple(_merge(self.other, other.other, *keep))
+        return s
+
+    def union(self, other: IPSet) -> IPSet:
+        return self._combine(other, (True, True, True))
+
+    def difference(self, other: IPSet) -> IPSet:
+        return self._combine(other, (True, False, False))
+
+    def intersection(self, other: IPSet) -> IPSet:
+        return self._combine(other, (False, True, False))
+
+    __or__ = union
+    __sub__ = difference
+    __and__ = intersection
+
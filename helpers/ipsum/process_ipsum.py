@@ -3,96 +3,212 @@ from typing import Dict, Any, List, Optional, Tuple
 
 from helpers import log
 
-from helpers.text_lists import fetch_text_lines
+from helpers.text_lists import iter_last_text_lines, iter_text_lines
+from helpers.fetch import commit_fetch
+from helpers.change_detect import unchanged
+from helpers.aggregate import maybe_aggregate
 from helpers.ipsum.scored_lists import parse_scored_lines
+from helpers.ipset import IPSet
+from helpers.cidr_index import apply_exclusion, load_exclusion_index
+from helpers.set_algebra import apply_set_operations, is_wanted, record_result
 
-from helpers.hash import _hash_list
-from helpers.grouping import upsert_grouped_entries, cleanup_extra_groups
-from helpers.rules_sync import sync_rule_to_used
-from helpers.snapshot import load_ip_snapshots
+from helpers.hash import set_fingerprint
+from helpers.grouping import upsert_grouped_entries, cleanup_extra_groups, empty_group_indices, GROUP_FINGERPRINTS_KEY
+from helpers.rules_sync import group_ids_for_ranges, sync_rule_to_groups, sync_rule_to_used
+from helpers.snapshot import has_ip_snapshot, load_ip_snapshots, save_ip_snapshot
+from helpers.pacing import DEFAULT_MAX_BATCH_BYTES
 
-RuleAction = Tuple[str, Optional[int], str, bool, int]
+# rule name, policy, base group, enabled, groups used, and in cumulative
+# mode the ids of all groups the rule covers
+RuleAction = Tuple[str, Optional[int], str, bool, int, Optional[List[int]]]
 
 _ACTION_BY_POLICY = {"allow": 0, "deny": 1}
 
 
-def process_ipsum_scored(
-    name: str,
-    cfg: Dict[str, Any],
-    state: Dict[str, Any]
-) -> List[RuleAction]:
-    actions: List[RuleAction] = []
-
-    base_core = cfg["group_base"]
-    base_prefix = f"parc_{base_core}"
-
+def _ipsum_config(name: str, cfg: Dict[str, Any]) -> Optional[Tuple[str, List[Dict[str, Any]], List[int]]]:
     urls = cfg.get("urls") or []
     if len(urls) != 1:
         log.warning("%s: txt-scored expects exactly one URL — got %d", name, len(urls))
-        return actions
-    url = urls[0]
-
-    txt_def = cfg.get("txt", {}) or {}
-    upload_def = cfg.get("upload", {}) or {}
-    rules_def = cfg.get("rules", {}) or {}
-    exclude_from = cfg.get("exclude_from")
+        return None
 
     lvl_defs: List[Dict[str, Any]] = cfg.get("levels") or []
     if not lvl_defs:
         log.warning("%s: no 'levels' configured for txt-scored — skipping.", name)
-        return actions
+        return None
 
     wanted_levels = [int(ld["level"]) for ld in lvl_defs if ld.get("enabled", True)]
     if not wanted_levels:
         log.info("%s: no levels enabled — nothing to do.", name)
-        return actions
+        return None
+    return urls[0], lvl_defs, wanted_levels
+
+
+def _mode_key(name: str) -> str:
+    return f"txtscored:{name}:mode"
+
+
+def _mode(cfg: Dict[str, Any]) -> str:
+    return "cumulative" if cfg.get("cumulative", False) else "level"
+
+
+def fetch_ipsum_scored(
+    name: str,
+    cfg: Dict[str, Any],
+    state: Dict[str, Any]
+) -> Optional[Dict[int, IPSet]]:
+    """
+    Download and split the feed by level. None means there is nothing to
+    push (bad config, failed fetch or 304). No SafeLine calls, no state writes.
+    """
+    conf = _ipsum_config(name, cfg)
+    if conf is None:
+        return None
+    url, _, wanted_levels = conf
+    txt_def = cfg.get("txt", {}) or {}
 
     try:
-        lines = fetch_text_lines(url)
+        lines = iter_text_lines(url, state=state)
+        if lines is None:
+            if state.get(_mode_key(name), "level") == _mode(cfg):
+                log.info("%s: not modified — skip.", name)
+                return None
+            # 'cumulative' was switched: the rules change, so parse the last payload again
+            lines = iter_last_text_lines(url, state)
+
+        return parse_scored_lines(
+            lines,
+            field_sep=txt_def.get("field_sep", "\t"),
+            ip_index=int(txt_def.get("ip_index", 0)),
+            score_index=int(txt_def.get("score_index", 1)),
+            valid_levels=wanted_levels,
+            label=name,
+        )
     except Exception as e:
         log.error("%s: fetch failed for %s: %s", name, url, e)
+        return None
+
+
+def _group_count(state: Dict[str, Any], base_group: str) -> int:
+    return int(state.get(f"{base_group}_group_count", 0))
+
+
+def _empty_indices(state: Dict[str, Any], base_group: str) -> List[int]:
+    return list(state.get(f"{base_group}_empty_groups") or [])
+
+
+def _cumulative_rule_actions(
+    state: Dict[str, Any],
+    level_rules: List[Tuple[int, str, Optional[int], str, bool]]
+) -> List[RuleAction]:
+    """
+    Point the rule of every level N at the groups of levels N..max, using
+    the group counts and empty groups in the state (also of levels skipped
+    as unchanged).
+    """
+    actions: List[RuleAction] = []
+    ordered = sorted(level_rules)
+    for i, (level, rule_name, pol, base_group, rule_enabled) in enumerate(ordered):
+        ranges = [(bg, _group_count(state, bg), _empty_indices(state, bg)) for _, _, _, bg, _ in ordered[i:]]
+        used = sum(count for _, count, _ in ranges)
+        gids = group_ids_for_ranges(ranges)
+        actions.append((rule_name, pol, base_group, rule_enabled, used, gids))
+        try:
+            sync_rule_to_groups(rule_name, gids)
+        except Exception as e:
+            log.warning("rule sync failed for '%s': %s", rule_name, e)
+    return actions
+
+
+def process_ipsum_scored(
+    name: str,
+    cfg: Dict[str, Any],
+    state: Dict[str, Any]
+) -> List[RuleAction]:
+    level_map = fetch_ipsum_scored(name, cfg, state)
+    if level_map is None:
+        return []
+    return push_ipsum_scored(name, cfg, state, level_map)
+
+
+def push_ipsum_scored(
+    name: str,
+    cfg: Dict[str, Any],
+    state: Dict[str, Any],
+    level_map: Dict[int, IPSet]
+) -> List[RuleAction]:
+    actions: List[RuleAction] = []
+
+    conf = _ipsum_config(name, cfg)
+    if conf is None:
         return actions
+    url, lvl_defs, _ = conf
+
+    base_core = cfg["group_base"]
+    base_prefix = f"parc_{base_core}"
 
-    level_map = parse_scored_lines(
-        lines,
-        field_sep=txt_def.get("field_sep", "\t"),
-        ip_index=int(txt_def.get("ip_index", 0)),
-        score_index=int(txt_def.get("score_index", 1)),
-        valid_levels=wanted_levels,
-    )
+    upload_def = cfg.get("upload", {}) or {}
+    rules_def = cfg.get("rules", {}) or {}
+    exclude_from = cfg.get("exclude_from") or []
+    if isinstance(exclude_from, str):
+        exclude_from = [exclude_from]
+    exclude_from = [x.strip() for x in exclude_from if x and str(x).strip()]
+    # loaded once for all levels
+    exclude_set = load_ip_snapshots(exclude_from) if exclude_from else IPSet()
+    exclude_index = load_exclusion_index(name, cfg)
+    # union of all levels, for other sources' exclude_cidrs_from
+    pushed_any = False
+    union = IPSet()
+    # cumulative: every level keeps its own groups, but the rule of level N
+    # covers the groups of all enabled levels >= N
+    mode = _mode(cfg)
+    cumulative = mode == "cumulative"
+    level_rules: List[Tuple[int, str, Optional[int], str, bool]] = []
+    mode_changed = state.get(_mode_key(name), "level") != mode
+    # the rule of one level may point at the surplus groups of another (now
+    # or before the mode changed): clean them up once all rules are re-pointed
+    defer_cleanup = cumulative or mode_changed
+    cleanups: List[Dict[str, Any]] = []
+    # hashes and group counts of the pushed levels, kept only if every level
+    # went through
+    pushed: Dict[str, Any] = {}
 
     for ld in lvl_defs:
         if not ld.get("enabled", True):
             continue
 
         level = int(ld["level"])
-        ips = level_map.get(level, [])
+        level_set = level_map.get(level) or IPSet()
 
         rules_cfg = {**rules_def, **(ld.get("rules") or {})}
         upload = {**upload_def, **(ld.get("upload") or {})}
 
-        if isinstance(exclude_from, str):
-            exclude_from = [exclude_from]
-
-        exclude_from = [x.strip() for x in exclude_from if x and str(x).strip()]
-        if exclude_from:
-            exclude_set = load_ip_snapshots(exclude_from)
-            if exclude_set:
-                ips = [ip for ip in ips if ip not in exclude_set]
+        if exclude_set:
+            level_set = level_set - exclude_set
+        label = f"{name}/l{level}"
+        level_set = apply_set_operations(label, {**cfg, **ld}, level_set)
+        level_set = apply_exclusion(label, exclude_index, level_set)
+        level_set = maybe_aggregate(label, {**cfg, **ld}, level_set)
+        union = union | level_set
+        record_result(label, level_set)
+        ips = level_set.to_list()
 
         base_group = f"{base_prefix}-l{level}"
         state_key = f"txtscored:{name}:{level}:{url}"
 
-        new_hash = _hash_list(sorted(ips))
+        new_hash = set_fingerprint(ips)
         prev_hash = state.get(state_key)
 
         policy_str = rules_cfg.get("policy", "").lower().strip()
         pol = _ACTION_BY_POLICY.get(policy_str) if policy_str else None
         rule_enabled = bool(rules_cfg.get("enabled", True))
         rule_name = rules_cfg.get("name", base_group)
+        level_rules.append((level, rule_name, pol, base_group, rule_enabled))
 
-        if prev_hash == new_hash:
+        if unchanged(prev_hash, new_hash, ips):
             log.info("%s/l%d: unchanged — skip.", name, level)
+            state[state_key] = new_hash
+            if is_wanted(label) and not has_ip_snapshot(label):
+                save_ip_snapshot(label, level_set)
             continue
 
         used = upsert_grouped_entries(
@@ -103,26 +219,59 @@ def process_ipsum_scored(
             append_batch_size=int(upload.get("append_batch_size", 500)),
             sleep_between_batches=float(upload.get("sleep_between_batches", 0.2)),
             placeholder_ip=upload.get("placeholder_ip", "192.0.2.1"),
+            concurrency=int(upload.get("concurrency", 1)),
+            pacing=upload.get("pacing", "adaptive"),
+            max_batch_bytes=int(upload.get("max_batch_bytes", DEFAULT_MAX_BATCH_BYTES)),
+            delta=bool(upload.get("delta", False)),
+            fingerprints=state.setdefault(GROUP_FINGERPRINTS_KEY, {}),
+            partition=upload.get("partition", "slice"),
         )
 
-        actions.append((rule_name, pol, base_group, rule_enabled, used))
-
-        try:
-            sync_rule_to_used(rule_name, base_group, used)
-        except Exception as e:
-            log.warning("rule sync failed for '%s': %s", rule_name, e)
+        if not cumulative:
+            actions.append((rule_name, pol, base_group, rule_enabled, used, None))
+            try:
+                sync_rule_to_used(rule_name, base_group, used)
+            except Exception as e:
+                log.warning("rule sync failed for '%s': %s", rule_name, e)
 
         prev_groups = int(state.get(f"{base_group}_group_count", 0))
 
-        cleanup_extra_groups(
+        cleanup = dict(
             base_group_name=base_group,
             used_count=used,
             previous_count=prev_groups,
             placeholder_ip=upload.get("placeholder_ip", "192.0.2.1"),
             action=upload.get("cleanup", "delete"),
+            fingerprints=state.setdefault(GROUP_FINGERPRINTS_KEY, {}),
         )
+        if defer_cleanup:
+            cleanups.append(cleanup)
+        else:
+            cleanup_extra_groups(**cleanup)
+
+        pushed[state_key] = new_hash
+        pushed[f"{base_group}_group_count"] = used
+        pushed[f"{base_group}_empty_groups"] = empty_group_indices(base_group, used)
+        pushed_any = True
+        if is_wanted(label):
+            save_ip_snapshot(label, level_set)
 
-        state[state_key] = new_hash
-        state[f"{base_group}_group_count"] = used
+    state.update(pushed)
+    if cumulative and (pushed_any or mode_changed):
+        actions.extend(_cumulative_rule_actions(state, level_rules))
+    elif mode_changed:
+        # back to one level per rule
+        actions.extend((rn, pol, bg, en, _group_count(state, bg), None)
+                       for _, rn, pol, bg, en in level_rules)
+        for _, rn, _, bg, _ in level_rules:
+            sync_rule_to_used(rn, bg, _group_count(state, bg), _empty_indices(state, bg))
+    # deleting flushes the queued rule updates first
+    for cleanup in cleanups:
+        cleanup_extra_groups(**cleanup)
+    state[_mode_key(name)] = mode
 
+    record_result(name, union)
+    if pushed_any or not has_ip_snapshot(name):
+        save_ip_snapshot(name, union)
+    commit_fetch(state, url)
     return actions
\ No newline at end of file
@@ -1,5 +1,8 @@
 from __future__ import annotations
-from typing import Dict, List, Iterable, Optional
+from typing import Dict, Iterable, Optional
+
+from helpers.dedup import log_normalized
+from helpers.ipset import IPSet, IPSetBuilder
 
 def parse_scored_lines(
     lines: Iterable[str],
@@ -8,8 +11,14 @@ def parse_scored_lines(
     ip_index: int = 0,
     score_index: int = 1,
     valid_levels: Optional[Iterable[int]] = None,
-) -> Dict[int, List[str]]:
-    level_map: Dict[int, List[str]] = {}
+    label: Optional[str] = None,
+) -> Dict[int, IPSet]:
+    """
+    Consumes 'lines' once, so it can be a stream; entries are normalized
+    and packed straight into one IPSet per level, invalid ones dropped.
+    With a label, the counters are logged per level.
+    """
+    seen: Dict[int, IPSetBuilder] = {}
     valid = set(valid_levels) if valid_levels is not None else None
 
     for raw in lines:
@@ -28,8 +37,14 @@ def parse_scored_lines(
         if valid is not None and lvl not in valid:
             continue
 
-        level_map.setdefault(lvl, []).append(ip)
+        bucket = seen.get(lvl)
+        if bucket is None:
+            bucket = seen[lvl] = IPSetBuilder(keep_invalid=False)
+        bucket.add(ip)
 
-    for k, v in level_map.items():
-        level_map[k] = sorted(set(v))
-    return level_map
\ No newline at end of file
+    out: Dict[int, IPSet] = {}
+    for lvl, bucket in seen.items():
+        out[lvl] = bucket.build()
+        if label:
+            log_normalized(f"{label}/l{lvl}", bucket, len(out[lvl]))
+    return out
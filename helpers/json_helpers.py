@@ -1,11 +1,18 @@
-import requests
-from typing import Tuple, List, Optional, Iterable
+import json
+from typing import Any, Dict, Tuple, List, Optional, Iterable
 from helpers.creation_time import parse_creation_time
+from helpers.fetch import fetch_raw
+from helpers.raw_cache import open_raw
 
-def fetch_json(url: str, timeout: int = 20) -> dict:
-    r = requests.get(url, timeout=timeout)
-    r.raise_for_status()
-    return r.json()
+def fetch_json(url: str, timeout: int = 20, state: Optional[Dict[str, Any]] = None) -> Optional[dict]:
+    """
+    With state, None means not modified (304 or same payload as last run).
+    """
+    digest = fetch_raw(url, state, timeout=timeout)
+    if digest is None:
+        return None
+    with open_raw(digest) as f:
+        return json.load(f)
 
 def extract_cidrs_from_json(data: dict, cidr_fields: Iterable[str] = None) -> List[str]:
     if cidr_fields is None:
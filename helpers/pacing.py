@@ -0,0 +1,176 @@
+from __future__ import annotations
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Sequence
+
+import requests
+
+from helpers import log
+
+STATE_KEY = "pacing:safeline"
+DEFAULT_MAX_BATCH_BYTES = 512 * 1024
+RETRY_STATUS = frozenset({429, 500, 502, 503, 504})
+
+# time the calling thread's last SafeLine request spent on the wire, without
+# the wait for a host slot (set by api.safeline._request)
+_request_time = threading.local()
+
+
+def note_request_time(seconds: float) -> None:
+    _request_time.seconds = seconds
+
+
+def _status_of(e: Exception) -> Optional[int]:
+    resp = getattr(e, "response", None)
+    return getattr(resp, "status_code", None)
+
+
+class FixedPacer:
+    """
+    Fixed batch size and sleep, as configured in the source YAML.
+    """
+
+    def __init__(self, batch_size: int, delay: float) -> None:
+        self.batch_size = max(1, int(batch_size))
+        self.delay = max(0.0, float(delay))
+
+    def take(self, items: Sequence[str], start: int, limit: Optional[int] = None,
+             max_bytes: Optional[int] = None) -> int:
+        """
+        End index of the next batch starting at 'start': at most 'limit'
+        (default: the current batch size) entries and, if given, at most
+        'max_bytes' once serialized as a JSON list.
+        """
+        size = self.batch_size if limit is None else max(1, int(limit))
+        end = min(len(items), start + size)
+        if not max_bytes:
+            return end
+        budget = max_bytes - 2
+        for i, x in enumerate(items[start:end], start):
+            budget -= len(x) + 3
+            if budget < 0 and i > start:
+                return i
+        return end
+
+    def call(self, fn: Callable[..., Any], *args: Any) -> Any:
+        return fn(*args)
+
+    def pause(self) -> None:
+        if self.delay > 0:
+            time.sleep(self.delay)
+
+
+class AdaptivePacer(FixedPacer):
+    """
+    AIMD controller for SafeLine writes. While requests stay fast the batch
+    size grows and the delay shrinks; a 429/5xx or a latency spike halves
+    the batch size and doubles the delay. Shared by all upload workers.
+    Failed requests are not sent again here: the session already retries
+    the idempotent ones, and POSTs refused with 429/503.
+    """
+
+    def __init__(self, batch_size: int = 500, delay: float = 0.4, *,
+                 min_batch: int = 100, max_batch: int = 10_000, max_delay: float = 10.0,
+                 target_latency: float = 2.0) -> None:
+        super().__init__(batch_size, delay)
+        self.min_batch = min(min_batch, self.batch_size)
+        self.max_batch = max(max_batch, self.batch_size)
+        self.max_delay = max_delay
+        self.target_latency = target_latency
+        self.latency: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def _grow(self) -> None:
+        self.batch_size = min(self.max_batch, int(self.batch_size * 1.25) + 1)
+        self.delay = self.delay * 0.5 if self.delay > 0.01 else 0.0
+
+    def _shrink(self, factor: float, min_delay: float) -> None:
+        self.batch_size = max(self.min_batch, int(self.batch_size * factor))
+        self.delay = min(self.max_delay, max(self.delay * 2, min_delay))
+
+    def observe(self, elapsed: float, status: Optional[int] = None) -> None:
+        with self._lock:
+            if status in RETRY_STATUS:
+                self._shrink(0.5, 0.5)
+                log.warning("[PACING] HTTP %s → batch %d, delay %.2fs", status, self.batch_size, self.delay)
+                return
+            baseline = self.latency
+            self.latency = elapsed if baseline is None else 0.7 * baseline + 0.3 * elapsed
+            if elapsed > self.target_latency or (baseline and baseline > 0.05 and elapsed > 2 * baseline):
+                self._shrink(0.7, 0.1)
+                log.debug("[PACING] slow request %.2fs → batch %d, delay %.2fs",
+                          elapsed, self.batch_size, self.delay)
+            elif elapsed < self.target_latency / 2:
+                self._grow()
+
+    def call(self, fn: Callable[..., Any], *args: Any) -> Any:
+        _request_time.seconds = None
+        t0 = time.monotonic()
+        try:
+            result = fn(*args)
+        except requests.HTTPError as e:
+            self.observe(self._elapsed(t0), _status_of(e))
+            raise
+        self.observe(self._elapsed(t0))
+        return result
+
+    @staticmethod
+    def _elapsed(t0: float) -> float:
+        # the request alone: waiting for a host slot behind other workers
+        # is contention, not a slow server
+        seconds = getattr(_request_time, "seconds", None)
+        return time.monotonic() - t0 if seconds is None else seconds
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"batch_size": self.batch_size, "delay": round(self.delay, 3), "latency": self.latency}
+
+    def restore(self, saved: Dict[str, Any]) -> None:
+        try:
+            self.batch_size = min(self.max_batch, max(self.min_batch, int(saved["batch_size"])))
+            self.delay = min(self.max_delay, max(0.0, float(saved["delay"])))
+            self.latency = saved.get("latency")
+        except (KeyError, TypeError, ValueError):
+            pass
+
+
+# One adaptive pacer per upload tuning (append_batch_size, sleep_between_batches):
+# SafeLine is a single host, so what one source learns applies to the next
+# source tuned the same way. Learned values are kept per tuning in the state
+# file, so changing the YAML starts again from the new values.
+_pacers: Dict[str, AdaptivePacer] = {}
+_saved: Dict[str, Any] = {}
+_pacers_lock = threading.Lock()
+
+
+def _tuning_key(batch_size: int, delay: float) -> str:
+    return f"{int(batch_size)}/{float(delay):g}"
+
+
+def get_pacer(batch_size: Optional[int] = None, delay: Optional[float] = None) -> AdaptivePacer:
+    """
+    The adaptive pacer seeded with a source's append_batch_size and
+    sleep_between_batches, resumed from earlier runs with the same values.
+    """
+    batch_size = 500 if batch_size is None else batch_size
+    delay = 0.4 if delay is None else delay
+    key = _tuning_key(batch_size, delay)
+    with _pacers_lock:
+        pacer = _pacers.get(key)
+        if pacer is None:
+            pacer = _pacers[key] = AdaptivePacer(batch_size, delay)
+            saved = _saved.get(key)
+            if isinstance(saved, dict):
+                pacer.restore(saved)
+        return pacer
+
+
+def load_pacing(state: Dict[str, Any]) -> None:
+    global _saved
+    saved = state.get(STATE_KEY)
+    # the old single-pacer format (batch_size, delay, ...) is dropped
+    _saved = {k: v for k, v in saved.items() if isinstance(v, dict)} if isinstance(saved, dict) else {}
+
+
+def store_pacing(state: Dict[str, Any]) -> None:
+    if _pacers or _saved:
+        state[STATE_KEY] = {**_saved, **{k: p.snapshot() for k, p in _pacers.items()}}
@@ -4,26 +4,223 @@ from typing import Dict, List, Optional, Any
 from api.abuse_ip import fetch_abuseip_blacklist
 from api.rules import delete_rule
 from helpers.json_helpers import fetch_json, extract_cidrs_from_json
-from helpers.grouping import upsert_grouped_entries, cleanup_extra_groups
-from helpers.hash import _hash_list
-from helpers.radb import get_radb_prefixes_for_asn
+from helpers.grouping import upsert_grouped_entries, cleanup_extra_groups, GROUP_FINGERPRINTS_KEY
+from helpers.hash import config_digest, set_fingerprint
+from helpers.radb import DEFAULT_PORT, DEFAULT_SERVER, get_radb_prefixes_for_asn, resolve_irr_prefixes
 from config.credentials import settings
 
 from helpers.rules_sync import sync_rule_to_used
 from helpers.rule_init import ensure_rule_safe
-from helpers.dedup import dedup_cidrs
-from helpers.change_detect import decide_change
+from helpers.dedup import log_normalized, normalize_cidrs
+from helpers.ipset import IPSet, IPSetBuilder
+from helpers.change_detect import decide_change, forced_change, unchanged
+from helpers.aggregate import maybe_aggregate
 from helpers import log
-from helpers.text_lists import fetch_text_lines
-from helpers.ipsum.process_ipsum import process_ipsum_scored
-from helpers.snapshot import save_ip_snapshot
-
-
-def process_source(name: str, cfg: Dict[str, Any], state: Dict[str, Any]) -> None:
+from helpers.text_lists import iter_last_text_lines, iter_text_lines
+from helpers.fetch import commit_fetch, from_cache, reading_cache, replay_payload, store_payload
+from helpers.raw_cache import iter_raw_lines
+from helpers.ipsum.process_ipsum import fetch_ipsum_scored, push_ipsum_scored
+from helpers.snapshot import has_ip_snapshot, save_ip_snapshot, snapshot_version
+from helpers.cidr_index import CIDRIndex, apply_exclusion, exclusion_sources, load_exclusion_index
+from helpers.set_algebra import apply_set_operations, record_result, set_sources
+from helpers.pacing import DEFAULT_MAX_BATCH_BYTES
+
+
+def fetch_source(name: str, cfg: Dict[str, Any], state: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Download and parse one source. Talks to the upstream only, never to
+    SafeLine, and does not write state, so several sources can be fetched
+    in parallel. Returns what push_source() needs, or None if there is
+    nothing to push.
+    """
     if not cfg.get("enabled", False):
         log.debug("%s: disabled", name)
+        return None
+
+    kind = cfg["kind"]
+
+    if kind == "txt-scored":
+        level_map = fetch_ipsum_scored(name, cfg, state)
+        if level_map is None:
+            return None
+        return {"level_map": level_map}
+
+    if kind == "json-cidrs":
+        json_cfg = cfg.get("json", {}) or {}
+        ts_field = json_cfg.get("timestamp_field", "creationTime")
+        cidr_fields = json_cfg.get("cidr_fields")
+
+        docs = []
+        for url in cfg["urls"]:
+            data = fetch_json(url, state=state)
+            if data is None:
+                docs.append((url, None, None))
+                continue
+            cidrs = normalize_cidrs(url, extract_cidrs_from_json(data, cidr_fields))
+            docs.append((url, cidrs, data.get(ts_field)))
+        return {"docs": docs}
+
+    if kind == "whois-radb":
+        rconf = cfg.get("radb", {}) or {}
+        asns = rconf.get("asns") or ([rconf["asn"]] if rconf.get("asn") else [])
+        as_sets = rconf.get("as_sets") or []
+        if isinstance(asns, str):
+            asns = [asns]
+        if isinstance(as_sets, str):
+            as_sets = [as_sets]
+
+        if not asns and not as_sets:
+            log.warning("%s: missing RADB ASN — skipping.", name)
+            return None
+
+        server = rconf.get("server", DEFAULT_SERVER)
+        port = int(rconf.get("port", DEFAULT_PORT))
+        # single ASN: same state key as before, radb:<asn>
+        label = asns[0] if len(asns) == 1 and not as_sets else ",".join(
+            [str(a) for a in asns] + [str(s) for s in as_sets])
+        raw_key = f"radb:{label}"
+
+        if reading_cache():
+            digest = replay_payload(state, raw_key)
+            cidrs = normalize_cidrs(name, (c.strip() for c in iter_raw_lines(digest) if c.strip()))
+            return {"asn": label, "cidrs": cidrs}
+
+        if len(asns) == 1 and not as_sets:
+            cidrs = get_radb_prefixes_for_asn(label, server=server, port=port)
+        else:
+            cidrs = resolve_irr_prefixes(asns, as_sets, server=server, port=port, sources=rconf.get("sources"))
+        cidrs = normalize_cidrs(name, cidrs or [])
+
+        if not cidrs:
+            # never replace a live allow list with nothing because a lookup failed
+            log.warning("%s: no prefixes resolved for %s — skipping.", name, label)
+            return None
+        if store_payload(raw_key, state, ["\n".join(cidrs).encode("utf-8")]) is None:
+            log.info("RADB %s: unchanged — skip.", label)
+            return None
+        return {"asn": label, "cidrs": cidrs}
+
+    if kind == "abuseipdb":
+        p = cfg["api"]
+        api_key = settings.ABUSEIPDB_KEY
+        if not api_key:
+            log.warning("%s: abuseipdb.api_key missing — skipping.", name)
+            return None
+
+        fetched = fetch_abuseip_blacklist(
+            api_key,
+            p["url"],
+            p["confidence_min"],
+            state=state,
+        )
+        if fetched is None:
+            log.info("%s: payload unchanged — skip.", p["url"])
+            return None
+        ips, generated_at = fetched
+        ips = normalize_cidrs(name, ips)
+        return {"ips": ips, "generated_at": generated_at}
+
+    if kind == "txt-cidrs":
+        urls = cfg.get("urls") or []
+        if not urls:
+            log.warning("%s: no urls configured — skipping.", name)
+            return None
+
+        # lines of every URL are packed straight into one set, no per-URL lists
+        entries = IPSetBuilder(keep_invalid=False)
+        unmodified_urls: List[str] = []
+        for u in urls:
+            try:
+                lines = iter_text_lines(u, state=state)
+                if lines is None:
+                    unmodified_urls.append(u)
+                else:
+                    entries.update(lines)
+            except Exception as e:
+                log.error("%s: fetch failed for %s: %s", name, u, e)
+                continue
+
+        if unmodified_urls and len(unmodified_urls) == len(urls):
+            return {"urls": urls, "entries": None}
+        for u in unmodified_urls:
+            # another URL changed: the unchanged one is needed in full
+            entries.update(iter_last_text_lines(u, state))
+        unique = entries.build()
+        log_normalized(name, entries, len(unique))
+        return {"urls": urls, "entries": unique}
+
+    if kind == "combined":
+        # built only from other sources' results in push_source()
+        return {"urls": [], "entries": IPSet()}
+
+    log.warning("%s: unknown kind '%s' – skipping.", name, kind)
+    return None
+
+
+def _pre_upload(label: str, cfg: Dict[str, Any], index: Optional[CIDRIndex], entries: IPSet) -> IPSet:
+    """
+    Set operations, exclusion, then aggregation, as for txt-scored levels;
+    the entries stay an IPSet until they are hashed and uploaded.
+    """
+    entries = apply_exclusion(label, index, apply_set_operations(label, cfg, entries))
+    return maybe_aggregate(label, cfg, entries)
+
+
+def _inputs_key(name: str) -> str:
+    return f"inputs:{name}"
+
+
+def source_inputs(cfg: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    What a source's push depends on besides its upstream payload: its
+    config, and the snapshots its exclude_from, exclude_cidrs_from and sets
+    read (by version, as written by their last push).
+    """
+    deps = cfg.get("exclude_from") or []
+    if isinstance(deps, str):
+        deps = [deps]
+    names = {str(d).strip() for d in deps if d and str(d).strip()}
+    names |= set(exclusion_sources(cfg)) | set_sources(cfg)
+    return {"config": config_digest(cfg), "deps": {n: snapshot_version(n) for n in sorted(names)}}
+
+
+def _not_modified(fetched: Optional[Dict[str, Any]]) -> bool:
+    # any payload of the source was skipped at fetch time as unchanged
+    if fetched is None:
+        return True
+    if "docs" in fetched:
+        return any(cidrs is None for _, cidrs, _ in fetched["docs"])
+    return "entries" in fetched and fetched["entries"] is None
+
+
+def push_source(name: str, cfg: Dict[str, Any], state: Dict[str, Any],
+                fetched: Optional[Dict[str, Any]]) -> None:
+    """
+    Apply the result of fetch_source() to SafeLine and the state. An
+    unchanged payload (fetched None, or parts of it) is rebuilt from the raw
+    cache if the source's config or a source it reads changed since its
+    last push; a config change also pushes unchanged entries again.
+    """
+    inputs = source_inputs(cfg)
+    prev = state.get(_inputs_key(name))
+    if not isinstance(prev, dict):
+        # first run with this record: take the inputs as they are
+        prev = inputs
+    config_changed = prev.get("config") != inputs["config"]
+    if (config_changed or prev.get("deps") != inputs["deps"]) and _not_modified(fetched):
+        log.info("%s: %s changed — rebuilding from the cached payload", name,
+                 "config" if config_changed else "a source it reads")
+        with from_cache():
+            fetched = fetch_source(name, cfg, state)
+    if fetched is None:
+        state.setdefault(_inputs_key(name), inputs)
         return
+    with forced_change(config_changed):
+        _push_fetched(name, cfg, state, fetched)
+    state[_inputs_key(name)] = inputs
+
 
+def _push_fetched(name: str, cfg: Dict[str, Any], state: Dict[str, Any], fetched: Dict[str, Any]) -> None:
     kind = cfg["kind"]
     base_core = cfg["group_base"]
     base = f"parc_{base_core}"
@@ -42,13 +239,18 @@ def process_source(name: str, cfg: Dict[str, Any], state: Dict[str, Any]) -> Non
     sleep_between_batches = upload.get("sleep_between_batches")
     cleanup_action = upload.get("cleanup")
     placeholder_ip = upload.get("placeholder_ip")
+    concurrency = int(upload.get("concurrency", 1))
+    pacing = upload.get("pacing", "adaptive")
+    max_batch_bytes = int(upload.get("max_batch_bytes", DEFAULT_MAX_BATCH_BYTES))
+    delta = bool(upload.get("delta", False))
+    partition = upload.get("partition", "slice")
 
     detector = cfg.get("change_detector", "timestamp").lower()
 
     if kind == "txt-scored":
-        actions = process_ipsum_scored(name, cfg, state)
+        actions = push_ipsum_scored(name, cfg, state, fetched["level_map"])
 
-        for rule_name, rule_policy, base, rule_enabled, used in actions:
+        for rule_name, rule_policy, base, rule_enabled, used, group_ids in actions:
 
             if rule_policy is None or used == 0:
                 if delete_rule(rule_name):
@@ -56,22 +258,20 @@ def process_source(name: str, cfg: Dict[str, Any], state: Dict[str, Any]) -> Non
                 else:
                     log.debug("%s: no rule to delete (no policy in YAML)", rule_name)
             else:
-                ensure_rule_safe(rule_name, rule_policy, base, rule_enabled)
+                ensure_rule_safe(rule_name, rule_policy, base, rule_enabled, group_ids)
 
         return
 
-    if kind == "json-cidrs":
-        json_cfg = cfg.get("json", {}) or {}
-        ts_field = json_cfg.get("timestamp_field", "creationTime")
-        cidr_fields = json_cfg.get("cidr_fields")
+    exclude_index = load_exclusion_index(name, cfg)
 
-        for url in cfg["urls"]:
-            data = fetch_json(url)
-            new_ts = data.get(ts_field)
-            cidrs = extract_cidrs_from_json(data, cidr_fields)
-            _maybe_patch_json_source(
+    if kind == "json-cidrs":
+        for url, cidrs, new_ts in fetched["docs"]:
+            if cidrs is None:
+                log.info("%s: not modified — skip.", url)
+                continue
+            pushed = _maybe_patch_json_source(
                 url=url,
-                cidrs=cidrs,
+                cidrs=_pre_upload(url, cfg, exclude_index, cidrs),
                 new_ts=new_ts,
                 base_group=base,
                 state=state,
@@ -82,8 +282,18 @@ def process_source(name: str, cfg: Dict[str, Any], state: Dict[str, Any]) -> Non
                 sleep_between_batches=sleep_between_batches,
                 cleanup_action=cleanup_action,
                 rule_name=rule_name,
-                change_detector=detector
+                change_detector=detector,
+                concurrency=concurrency,
+                pacing=pacing,
+                max_batch_bytes=max_batch_bytes,
+                delta=delta,
+                partition=partition,
+                snapshot=name,
             )
+            commit_fetch(state, url)
+            if not pushed:
+                # unchanged: the rule is as the last push left it
+                continue
 
             if rule_policy is None:
                 if delete_rule(rule_name):
@@ -94,27 +304,28 @@ def process_source(name: str, cfg: Dict[str, Any], state: Dict[str, Any]) -> Non
                 ensure_rule_safe(rule_name, rule_policy, base, rule_enabled)
 
     elif kind == "whois-radb":
-        rconf = cfg.get("radb", {}) or {}
-        asn = rconf.get("asn")
-
-        if not asn:
-            log.warning("%s: missing RADB ASN — skipping.", name)
-            return
-
-        cidrs = get_radb_prefixes_for_asn(asn)
-        _maybe_patch_radb_source(
-            asn=asn,
+        pushed = _maybe_patch_radb_source(
+            asn=fetched["asn"],
             base_group=base,
             state=state,
-            cidrs=cidrs,
+            cidrs=_pre_upload(name, cfg, exclude_index, fetched["cidrs"]),
             placeholder_ip=placeholder_ip,
             max_per_group=max_per_group,
             initial_batch_size=initial_batch_size,
             append_batch_size=append_batch_size,
             sleep_between_batches=sleep_between_batches,
             cleanup_action=cleanup_action,
-            rule_name=rule_name
+            rule_name=rule_name,
+            concurrency=concurrency,
+            pacing=pacing,
+            max_batch_bytes=max_batch_bytes,
+            delta=delta,
+            partition=partition,
+            snapshot=name,
         )
+        if not pushed:
+            # unchanged: the rule is as the last push left it
+            return
 
         if rule_policy is None:
             if delete_rule(rule_name):
@@ -125,21 +336,10 @@ def process_source(name: str, cfg: Dict[str, Any], state: Dict[str, Any]) -> Non
             ensure_rule_safe(rule_name, rule_policy, base, rule_enabled)
 
     elif kind == "abuseipdb":
-        p = cfg["api"]
-        api_key = settings.ABUSEIPDB_KEY
-        if not api_key:
-            log.warning("%s: abuseipdb.api_key missing — skipping.", name)
-            return
-
-        ips, generated_at = fetch_abuseip_blacklist(
-            api_key,
-            p["url"],
-            p["confidence_min"],
-        )
-        _maybe_patch_abuseip(
-            state_key=p["url"],
-            ips=ips,
-            generated_at=generated_at,
+        pushed = _maybe_patch_abuseip(
+            state_key=cfg["api"]["url"],
+            ips=_pre_upload(name, cfg, exclude_index, fetched["ips"]),
+            generated_at=fetched["generated_at"],
             base_group=base,
             state=state,
             max_per_group=max_per_group,
@@ -148,8 +348,17 @@ def process_source(name: str, cfg: Dict[str, Any], state: Dict[str, Any]) -> Non
             sleep_between_batches=float(sleep_between_batches) if sleep_between_batches is not None else 0.4,
             cleanup_action=cleanup_action,
             placeholder_ip=placeholder_ip,
-            rule_name=rule_name
+            rule_name=rule_name,
+            concurrency=concurrency,
+            pacing=pacing,
+            max_batch_bytes=max_batch_bytes,
+            delta=delta,
+            partition=partition,
+            snapshot=name,
         )
+        if not pushed:
+            # unchanged: the rule is as the last push left it
+            return
 
         if rule_policy is None:
             if delete_rule(rule_name):
@@ -159,15 +368,15 @@ def process_source(name: str, cfg: Dict[str, Any], state: Dict[str, Any]) -> Non
         else:
             ensure_rule_safe(rule_name, rule_policy, base, rule_enabled)
 
-    elif kind == "txt-cidrs":
-        urls = cfg.get("urls") or []
-        if not urls:
-            log.warning("%s: no urls configured — skipping.", name)
+    elif kind in ("txt-cidrs", "combined"):
+        if fetched["entries"] is None:
+            # no URL changed: groups and rule are as the last push left them
+            log.info("%s: not modified — skip.", name)
             return
-
-        _maybe_patch_txt_source(
+        pushed = _maybe_patch_txt_source(
             name=name,
-            urls=urls,
+            urls=fetched["urls"],
+            entries=_pre_upload(name, cfg, exclude_index, fetched["entries"]),
             base_group=base,
             state=state,
             rule_name=rule_name,
@@ -177,7 +386,14 @@ def process_source(name: str, cfg: Dict[str, Any], state: Dict[str, Any]) -> Non
             append_batch_size=int(upload.get("append_batch_size", 500)),
             sleep_between_batches=float(upload.get("sleep_between_batches", 0.2)),
             cleanup_action=upload.get("cleanup", "delete"),
+            concurrency=concurrency,
+            pacing=pacing,
+            max_batch_bytes=max_batch_bytes,
+            delta=delta,
+            partition=partition,
         )
+        if not pushed:
+            return
 
         if rule_policy is None:
             if delete_rule(rule_name):
@@ -187,13 +403,27 @@ def process_source(name: str, cfg: Dict[str, Any], state: Dict[str, Any]) -> Non
         else:
             ensure_rule_safe(rule_name, rule_policy, base, rule_enabled)
 
-    else:
-        log.warning("%s: unknown kind '%s' – skipping.", name, kind)
+
+def process_source(name: str, cfg: Dict[str, Any], state: Dict[str, Any]) -> None:
+    push_source(name, cfg, state, fetch_source(name, cfg, state))
+
+
+def _record_snapshot(snapshot: Optional[str], entries: IPSet, *, pushed: bool) -> None:
+    """
+    Keep what a source pushed for other sources' exclude_cidrs_from and
+    sets: after every push, and once for an unchanged source that has none
+    yet.
+    """
+    if not snapshot:
+        return
+    record_result(snapshot, entries)
+    if pushed or not has_ip_snapshot(snapshot):
+        save_ip_snapshot(snapshot, entries)
 
 
 def _maybe_patch_json_source(
     url: str,
-    cidrs: List[str],
+    cidrs: IPSet,
     new_ts: Optional[str],
     base_group: str,
     state: Dict[str, Any],
@@ -205,9 +435,15 @@ def _maybe_patch_json_source(
     sleep_between_batches: Optional[float],
     cleanup_action: str,
     rule_name: str,
-    change_detector: str = "timestamp"
-) -> None:
-    entries = dedup_cidrs(cidrs)
+    change_detector: str = "timestamp",
+    concurrency: int = 1,
+    pacing: str = "adaptive",
+    max_batch_bytes: int = DEFAULT_MAX_BATCH_BYTES,
+    delta: bool = False,
+    partition: str = "slice",
+    snapshot: Optional[str] = None,
+) -> bool:
+    entries = cidrs.to_list()
 
     state_key_ts = url
     state_key_hash = f"hash:{url}"
@@ -227,16 +463,23 @@ def _maybe_patch_json_source(
         else:
             log.info("%s: unchanged (%s) — skip.", url, new_ts)
         state.update(state_updates)
-        return
+        _record_snapshot(snapshot, cidrs, pushed=False)
+        return False
 
     used = upsert_grouped_entries(
-        entries=cidrs,
+        entries=entries,
         base_group_name=base_group,
         max_per_group=max_per_group,
         initial_batch_size=initial_batch_size,
         append_batch_size=append_batch_size,
         sleep_between_batches=sleep_between_batches,
         placeholder_ip=placeholder_ip,
+        concurrency=concurrency,
+        pacing=pacing,
+        max_batch_bytes=max_batch_bytes,
+        delta=delta,
+        fingerprints=state.setdefault(GROUP_FINGERPRINTS_KEY, {}),
+        partition=partition,
     )
 
     try:
@@ -251,50 +494,69 @@ def _maybe_patch_json_source(
         previous_count=prev_groups,
         action=(cleanup_action or "delete"),
         placeholder_ip=(placeholder_ip or "192.0.2.1"),
+        fingerprints=state.setdefault(GROUP_FINGERPRINTS_KEY, {}),
     )
 
     state.update(state_updates)
     state[f"{base_group}_group_count"] = used
     state[f"{base_group}_count"] = len(entries)
+    _record_snapshot(snapshot, cidrs, pushed=True)
 
     if "hash" in state_updates:
         log.info("%s: updated (hash changed, %d entries)", url, len(entries))
     else:
         log.info("%s: updated (%s -> %s, %d entries)",
                  url, state.get(state_key_ts), new_ts, len(entries))
+    return True
 
 def _maybe_patch_radb_source(
     *,
     asn: str,
     base_group: str,
     state: Dict[str, Any],
-    cidrs: List[str],
+    cidrs: IPSet,
     placeholder_ip: str,
     max_per_group: int,
     initial_batch_size: int,
     append_batch_size: int,
     sleep_between_batches: float,
     cleanup_action: str,
-    rule_name: str
-) -> None:
+    rule_name: str,
+    concurrency: int = 1,
+    pacing: str = "adaptive",
+    max_batch_bytes: int = DEFAULT_MAX_BATCH_BYTES,
+    delta: bool = False,
+    partition: str = "slice",
+    snapshot: Optional[str] = None,
+) -> bool:
     key = f"radb:{asn}"
-    new_hash = _hash_list(cidrs)
+    entries = cidrs.to_list()
+    new_hash = set_fingerprint(entries)
     prev_hash = state.get(key)
 
-    if prev_hash == new_hash:
+    if unchanged(prev_hash, new_hash, entries):
         log.info("RADB %s: unchanged — skip.", asn)
-        return
+        state[key] = new_hash
+        _record_snapshot(snapshot, cidrs, pushed=False)
+        commit_fetch(state, key)
+        return False
 
     prev_groups = int(state.get(f"{base_group}_group_count", 0))
 
     used = upsert_grouped_entries(
-        entries=cidrs,
+        entries=entries,
         base_group_name=base_group,
         max_per_group=max_per_group,
         initial_batch_size=initial_batch_size,
         append_batch_size=append_batch_size,
         sleep_between_batches=sleep_between_batches,
         placeholder_ip=placeholder_ip,
+        concurrency=concurrency,
+        pacing=pacing,
+        max_batch_bytes=max_batch_bytes,
+        delta=delta,
+        fingerprints=state.setdefault(GROUP_FINGERPRINTS_KEY, {}),
+        partition=partition,
     )
 
     try:
@@ -307,16 +569,21 @@ def _maybe_patch_radb_source(
         used_count=used,
         previous_count=prev_groups,
         placeholder_ip=placeholder_ip,
-        action=cleanup_action
+        action=cleanup_action,
+        fingerprints=state.setdefault(GROUP_FINGERPRINTS_KEY, {}),
     )
 
     state[f"{base_group}_group_count"] = used
     state[key] = new_hash
+    _record_snapshot(snapshot, cidrs, pushed=True)
+    commit_fetch(state, key)
+    return True
 
 def _maybe_patch_txt_source(
     *,
     name: str,
     urls: list[str],
+    entries: IPSet,
     base_group: str,
     state: dict,
     rule_name: str,
@@ -326,24 +593,24 @@ def _maybe_patch_txt_source(
     append_batch_size: int,
     sleep_between_batches: float,
     cleanup_action: str | None,
-) -> None:
-    all_lines: list[str] = []
-    for u in urls:
-        try:
-            lines = fetch_text_lines(u)
-            all_lines.extend(lines)
-        except Exception as e:
-            log.error("%s: fetch failed for %s: %s", name, u, e)
-            continue
-
-    unique_ips = dedup_cidrs(all_lines)
+    concurrency: int = 1,
+    pacing: str = "adaptive",
+    max_batch_bytes: int = DEFAULT_MAX_BATCH_BYTES,
+    delta: bool = False,
+    partition: str = "slice",
+) -> bool:
+    unique_ips = entries.to_list()
     key = f"txt:{name}"
-    new_hash = _hash_list(unique_ips)
+    new_hash = set_fingerprint(unique_ips)
     prev_hash = state.get(key)
 
-    if prev_hash == new_hash:
+    if unchanged(prev_hash, new_hash, unique_ips):
         log.info("%s: unchanged — skip.", name)
-        return
+        state[key] = new_hash
+        _record_snapshot(name, entries, pushed=False)
+        for u in urls:
+            commit_fetch(state, u)
+        return False
 
     log.info("%s: hash changed", name)
 
@@ -355,6 +622,12 @@ def _maybe_patch_txt_source(
         append_batch_size=append_batch_size,
         sleep_between_batches=sleep_between_batches,
         placeholder_ip=placeholder_ip,
+        concurrency=concurrency,
+        pacing=pacing,
+        max_batch_bytes=max_batch_bytes,
+        delta=delta,
+        fingerprints=state.setdefault(GROUP_FINGERPRINTS_KEY, {}),
+        partition=partition,
     )
 
     try:
@@ -370,16 +643,21 @@ def _maybe_patch_txt_source(
         previous_count=prev_groups,
         placeholder_ip=placeholder_ip,
         action=cleanup_action,
+        fingerprints=state.setdefault(GROUP_FINGERPRINTS_KEY, {}),
     )
 
     state[key] = new_hash
     state[f"{base_group}_group_count"] = used
+    _record_snapshot(name, entries, pushed=True)
+    for u in urls:
+        commit_fetch(state, u)
     log.info("%s: updated (hash changed, %d entries)", key, len(unique_ips))
+    return True
 
 
 def _maybe_patch_abuseip(
     state_key: str,
-    ips: List[str],
+    ips: IPSet,
     generated_at: Optional[str],
     base_group: str,
     state: Dict[str, Any],
@@ -390,20 +668,29 @@ def _maybe_patch_abuseip(
     sleep_between_batches: float,
     cleanup_action: str,
     placeholder_ip: str,
-    rule_name: str
-) -> None:
+    rule_name: str,
+    concurrency: int = 1,
+    pacing: str = "adaptive",
+    max_batch_bytes: int = DEFAULT_MAX_BATCH_BYTES,
+    delta: bool = False,
+    partition: str = "slice",
+    snapshot: Optional[str] = None,
+) -> bool:
     prev_groups = int(state.get(f"{base_group}_group_count", 0))
 
-    unique_ips = dedup_cidrs(ips)
-    new_hash = _hash_list(unique_ips)
+    unique_ips = ips.to_list()
+    new_hash = set_fingerprint(unique_ips)
     hash_state_key = f"{state_key}#hash"
     prev_hash = state.get(hash_state_key)
 
-    if prev_hash == new_hash:
+    if unchanged(prev_hash, new_hash, unique_ips):
         log.info("%s: unchanged (hash) — skip.", state_key)
+        state[hash_state_key] = new_hash
         if generated_at:
             state[state_key] = generated_at
-        return
+        _record_snapshot(snapshot, ips, pushed=False)
+        commit_fetch(state, state_key)
+        return False
 
     used = upsert_grouped_entries(
         entries=unique_ips,
@@ -413,9 +700,15 @@ def _maybe_patch_abuseip(
         append_batch_size=append_batch_size,
         sleep_between_batches=sleep_between_batches,
         placeholder_ip=placeholder_ip,
+        concurrency=concurrency,
+        pacing=pacing,
+        max_batch_bytes=max_batch_bytes,
+        delta=delta,
+        fingerprints=state.setdefault(GROUP_FINGERPRINTS_KEY, {}),
+        partition=partition,
     )
 
-    save_ip_snapshot("abuseip", ips)
+    _record_snapshot(snapshot, ips, pushed=True)
 
     try:
         sync_rule_to_used(rule_name, base_group, used)
@@ -428,6 +721,7 @@ def _maybe_patch_abuseip(
         previous_count=prev_groups,
         action=cleanup_action,
         placeholder_ip=placeholder_ip,
+        fingerprints=state.setdefault(GROUP_FINGERPRINTS_KEY, {}),
     )
 
     state[hash_state_key] = new_hash
@@ -435,4 +729,6 @@ def _maybe_patch_abuseip(
         state[state_key] = generated_at
     state[f"{base_group}_group_count"] = used
     state[f"{base_group}_count"] = len(unique_ips)
-    log.info("%s: updated (hash changed, %d entries)", state_key, len(unique_ips))
\ No newline at end of file
+    commit_fetch(state, state_key)
+    log.info("%s: updated (hash changed, %d entries)", state_key, len(unique_ips))
+    return True
\ No newline at end of file
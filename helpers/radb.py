@@ -1,8 +1,23 @@
 from __future__ import annotations
 import socket
-from typing import List
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
 from helpers import log
 
+DEFAULT_SERVER = "whois.radb.net"
+DEFAULT_PORT = 43
+# queries written per round trip in persistent mode
+PIPELINE_DEPTH = 100
+
+
+class IRRError(Exception):
+    pass
+
+
+class IRRConnectionLost(IRRError):
+    pass
+
+
 def query_radb_origin(asn: str, server: str = "whois.radb.net", port: int = 43, timeout: float = 10.0) -> str:
     """
     Query RADB WHOIS for all prefixes originated by an ASN.
@@ -56,18 +71,188 @@ def parse_radb_routes(whois_text: str) -> List[str]:
     return cidrs
 
 
-def get_radb_prefixes_for_asn(asn: str) -> List[str]:
+class IRRClient:
     """
-    Convenience: query + parse, with a tiny retry.
+    One persistent IRRd connection ('!!' mode). Queries are pipelined and
+    answers read with their framing: 'A<len>' + data + 'C', or a bare
+    'C' (no data), 'D' (key not found), 'E' (no entries), 'F <msg>' (error).
     """
+
+    def __init__(self, server: str = DEFAULT_SERVER, port: int = DEFAULT_PORT,
+                 timeout: float = 10.0, sources: Optional[str] = None) -> None:
+        self.server = server
+        self.port = port
+        self.timeout = timeout
+        self.sources = sources
+        self._sock: Optional[socket.socket] = None
+        self._rfile = None
+
+    def _connect(self) -> None:
+        self._sock = socket.create_connection((self.server, self.port), timeout=self.timeout)
+        self._rfile = self._sock.makefile("rb", buffering=64 * 1024)
+        self._sock.sendall(b"!!\n")
+        if self.sources:
+            self._sock.sendall(f"!s{self.sources}\n".encode("ascii"))
+            self._read_answer("!s" + self.sources)
+
+    def close(self) -> None:
+        if self._sock is None:
+            return
+        try:
+            self._sock.sendall(b"!q\n")
+        except OSError:
+            pass
+        try:
+            self._rfile.close()
+            self._sock.close()
+        except OSError:
+            pass
+        self._sock = None
+        self._rfile = None
+
+    def _readline(self) -> bytes:
+        line = self._rfile.readline()
+        if not line:
+            raise IRRConnectionLost(f"{self.server}: connection closed")
+        return line.rstrip(b"\r\n")
+
+    def _read_answer(self, q: str) -> str:
+        head = self._readline()
+        while not head:  # tolerate blank lines between answers
+            head = self._readline()
+        code = head[:1]
+        if code == b"A":
+            try:
+                size = int(head[1:])
+            except ValueError:
+                raise IRRError(f"{self.server}: bad answer header {head!r}")
+            data = self._rfile.read(size)
+            if len(data) != size:
+                raise IRRError(f"{self.server}: short answer for {q}")
+            end = self._readline()
+            while not end:
+                end = self._readline()
+            if end[:1] != b"C":
+                raise IRRError(f"{self.server}: {q}: {end.decode('latin-1', 'replace')}")
+            return data.decode("latin-1", errors="replace")
+        if code in (b"C", b"D", b"E"):
+            return ""
+        if code == b"F":
+            raise IRRError(f"{self.server}: {q}: {head[1:].decode('latin-1', 'replace').strip()}")
+        raise IRRError(f"{self.server}: unexpected answer {head[:80]!r} (not an IRRd server?)")
+
+    def query_many(self, queries: Sequence[str]) -> List[str]:
+        """
+        Answers in query order. Reconnects once if the connection broke.
+        """
+        answers: List[str] = []
+        for i in range(0, len(queries), PIPELINE_DEPTH):
+            batch = queries[i:i + PIPELINE_DEPTH]
+            for attempt in (1, 2):
+                try:
+                    if self._sock is None:
+                        self._connect()
+                    self._sock.sendall("".join(q + "\n" for q in batch).encode("ascii"))
+                    answers.extend([self._read_answer(q) for q in batch])
+                    break
+                except (OSError, IRRConnectionLost):
+                    self.close()
+                    if attempt == 2:
+                        raise
+                except IRRError:
+                    self.close()
+                    raise
+        return answers
+
+
+# One connection per thread and server: fetches of several sources run in parallel.
+_local = threading.local()
+# (server, query) -> answer, shared by all sources of a run
+_cache: Dict[Tuple[str, str], str] = {}
+_cache_lock = threading.Lock()
+
+
+def _client(server: str, port: int, sources: Optional[str]) -> IRRClient:
+    clients = getattr(_local, "clients", None)
+    if clients is None:
+        clients = _local.clients = {}
+    key = (server, port, sources)
+    client = clients.get(key)
+    if client is None:
+        client = clients[key] = IRRClient(server, port, sources=sources)
+    return client
+
+
+def _irr_query(server: str, port: int, sources: Optional[str], queries: Sequence[str]) -> Dict[str, str]:
+    cache_key = f"{server}:{port}/{sources or ''}"
+    with _cache_lock:
+        out = {q: _cache[(cache_key, q)] for q in queries if (cache_key, q) in _cache}
+    todo = [q for q in dict.fromkeys(queries) if q not in out]
+    if todo:
+        answers = _client(server, port, sources).query_many(todo)
+        with _cache_lock:
+            for q, a in zip(todo, answers):
+                _cache[(cache_key, q)] = a
+                out[q] = a
+    return out
+
+
+def _norm_asn(asn: str) -> str:
+    asn = str(asn).strip().upper()
+    return asn if asn.startswith("AS") else f"AS{asn}"
+
+
+def resolve_irr_prefixes(
+    asns: Iterable[str] = (),
+    as_sets: Iterable[str] = (),
+    *,
+    server: str = DEFAULT_SERVER,
+    port: int = DEFAULT_PORT,
+    sources: Optional[str] = None,
+) -> List[str]:
+    """
+    IPv4 and IPv6 prefixes originated by the given ASNs and by all members
+    of the given AS-SETs (expanded recursively by the server), in one
+    persistent session. Sorted and deduplicated.
+    """
+    origins = {_norm_asn(a) for a in asns if str(a).strip()}
+    sets = [str(s).strip().upper() for s in as_sets if str(s).strip()]
+    if sets:
+        expanded = _irr_query(server, port, sources, [f"!i{s},1" for s in sets])
+        for s in sets:
+            members = expanded[f"!i{s},1"].split()
+            if not members:
+                log.warning("IRR %s: AS-SET %s has no members", server, s)
+            origins.update(_norm_asn(m) for m in members)
+
+    queries = [f"!{fam}{asn}" for asn in sorted(origins) for fam in ("g", "6")]
+    answers = _irr_query(server, port, sources, queries)
+    prefixes = set()
+    for q in queries:
+        prefixes.update(answers[q].split())
+    return sorted(prefixes)
+
+
+def get_radb_prefixes_for_asn(asn: str, server: str = DEFAULT_SERVER, port: int = DEFAULT_PORT) -> List[str]:
+    """
+    Convenience: query + parse, with a tiny retry. Uses the IRRd protocol
+    and falls back to a plain '-i origin' whois query.
+    """
+    try:
+        prefixes = resolve_irr_prefixes([asn], server=server, port=port)
+        if prefixes:
+            return prefixes
+        log.warning("IRR %s: no prefixes for %s — retrying with whois", server, asn)
+    except Exception as e:
+        log.warning("IRR query for %s on %s failed (%s) — falling back to whois", asn, server, e)
     try:
-        txt = query_radb_origin(asn)
+        txt = query_radb_origin(asn, server=server, port=port)
         prefixes = parse_radb_routes(txt)
         if prefixes:
             return prefixes
         # If empty, retry once (transient whois hiccups happen)
-        txt = query_radb_origin(asn)
+        txt = query_radb_origin(asn, server=server, port=port)
         return parse_radb_routes(txt)
     except Exception as e:
         log.error("RADB WHOIS failed for %s: %s", asn, e)
-        return []
\ No newline at end of file
+        return []
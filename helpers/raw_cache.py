@@ -0,0 +1,123 @@
+from __future__ import annotations
+import gzip
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+from typing import IO, Any, Dict, Iterable, Iterator, List, Optional
+
+from helpers import log
+
+# Raw upstream payloads, gzip-compressed and named by the sha256 of the
+# uncompressed bytes. state["raw:<key>"] lists the digests of the last
+# processed payloads of a source key (url, radb:<asn>, ...), newest first.
+RAW_DIR = Path("persist/raw")
+STATE_PREFIX = "raw:"
+CHUNK_SIZE = 64 * 1024
+
+
+def _raw_path(digest: str) -> Path:
+    return RAW_DIR / f"{digest}.gz"
+
+
+def store_raw(chunks: Iterable[bytes]) -> str:
+    """
+    Write a payload to the cache while it streams in; returns its digest.
+    """
+    h = hashlib.sha256()
+    RAW_DIR.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=RAW_DIR, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=1, mtime=0) as f:
+            for chunk in chunks:
+                if chunk:
+                    h.update(chunk)
+                    f.write(chunk)
+        digest = h.hexdigest()
+        path = _raw_path(digest)
+        if path.exists():
+            os.unlink(tmp)
+            path.touch()
+        else:
+            os.replace(tmp, path)
+        return digest
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+def has_raw(digest: str) -> bool:
+    return _raw_path(digest).exists()
+
+
+def open_raw(digest: str) -> IO[bytes]:
+    return gzip.open(_raw_path(digest), "rb")
+
+
+def iter_raw_chunks(digest: str) -> Iterator[bytes]:
+    with open_raw(digest) as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+
+def iter_raw_lines(digest: str, encoding: str = "utf-8") -> Iterator[str]:
+    with gzip.open(_raw_path(digest), "rt", encoding=encoding, errors="replace") as f:
+        yield from f
+
+
+def raw_history(state: Dict[str, Any], key: str) -> List[str]:
+    hist = state.get(STATE_PREFIX + key)
+    return list(hist) if isinstance(hist, list) else []
+
+
+def last_processed(state: Dict[str, Any], key: str) -> Optional[str]:
+    """
+    Digest of the last processed payload of 'key' if it is still cached.
+    """
+    hist = raw_history(state, key)
+    if hist and has_raw(hist[0]):
+        return hist[0]
+    return None
+
+
+def record_processed(state: Dict[str, Any], key: str, digest: str, keep: int) -> None:
+    hist = [d for d in raw_history(state, key) if d != digest]
+    state[STATE_PREFIX + key] = ([digest] + hist)[:max(1, keep)]
+
+
+def prune_raw_cache(state: Dict[str, Any], max_bytes: int) -> None:
+    """
+    Delete payloads no source references any more, then drop the oldest
+    history entries (never the last processed payload of a key) until
+    the cache fits into max_bytes.
+    """
+    hists = {k: v for k, v in state.items() if k.startswith(STATE_PREFIX) and isinstance(v, list)}
+    referenced = {d for hist in hists.values() for d in hist}
+    files = {p.name[:-len(".gz")]: p for p in RAW_DIR.glob("*.gz")}
+    for digest, path in files.items():
+        if digest not in referenced:
+            path.unlink(missing_ok=True)
+    for part in RAW_DIR.glob("*.part"):
+        part.unlink(missing_ok=True)
+
+    sizes = {d: p.stat().st_size for d, p in files.items() if d in referenced and p.exists()}
+    total = sum(sizes.values())
+    depth = max((len(h) for h in hists.values()), default=0)
+    # oldest generation first: the last entry of every history, then the one before, ...
+    for gen in range(depth - 1, 0, -1):
+        if total <= max_bytes:
+            break
+        for key, hist in hists.items():
+            if len(hist) <= gen or total <= max_bytes:
+                continue
+            digest = hist.pop(gen)
+            state[key] = hist
+            if not any(digest in h for h in hists.values()):
+                total -= sizes.pop(digest, 0)
+                _raw_path(digest).unlink(missing_ok=True)
+    if total > max_bytes:
+        log.warning("[RAW] cache holds %.1f MiB of current payloads (limit %.1f MiB)",
+                    total / 2**20, max_bytes / 2**20)
@@ -1,11 +1,13 @@
 from __future__ import annotations
+from typing import List, Optional
 
 from helpers.rules_sync import ensure_rule_for_source
 from helpers import log
 
-def ensure_rule_safe(rule_name: str, rule_policy: int, base: str, enabled: bool | None) -> bool:
+def ensure_rule_safe(rule_name: str, rule_policy: int, base: str, enabled: bool | None,
+                     group_ids: Optional[List[int]] = None) -> bool:
     try:
-        _ = ensure_rule_for_source(rule_name, rule_policy, base, enabled)
+        _ = ensure_rule_for_source(rule_name, rule_policy, base, enabled, group_ids)
         return True
     except Exception as e:
         log.warning("ensure_rule_for_source failed for '%s': %s", rule_name, e)
@@ -1,30 +1,34 @@
 from __future__ import annotations
-from typing import List
+from typing import Iterable, List, Optional, Tuple
 from api.rules import (
     get_rule_by_name,
     create_rule_minimal,
-    update_rule_action,
-    update_rule_ip_groups
+    queue_rule_update,
+    flush_rule_updates
 )
-from api.safeline import get_ip_group_id
+from api.safeline import groups_with_prefix
+from helpers.grouping import empty_groups
 from helpers import log
 
 
-def group_ids_for_range(base_group: str, count: int) -> List[int]:
-    ids: List[int] = []
-    for idx in range(1, count + 1):
-        name = f"{base_group}-{idx:03d}"
-        gid = get_ip_group_id(name)
-        if gid is not None:
-            ids.append(int(gid))
-    return ids
+def group_ids_for_range(base_group: str, count: int, empty_indices: Iterable[int] = ()) -> List[int]:
+    # groups of empty hash buckets hold only the placeholder: those marked
+    # in this run, and those of 'empty_indices' (as recorded in the state)
+    empty = empty_groups()
+    skip = set(empty_indices)
+    return [gid for idx, gid in groups_with_prefix(base_group).items()
+            if idx <= count and idx not in skip and gid not in empty]
+
+
+def group_ids_for_ranges(ranges: Iterable[Tuple[str, int, Iterable[int]]]) -> List[int]:
+    return [gid for base_group, count, empty in ranges for gid in group_ids_for_range(base_group, count, empty)]
 
 
 def ensure_rule_for_source(rule_name: str, policy: int, base_group: str,
-                           rule_enabled: bool) -> int:
+                           rule_enabled: bool, group_ids: Optional[List[int]] = None) -> int:
     rule = get_rule_by_name(rule_name)
     if not rule:
-        gids = group_ids_for_range(base_group, 999)
+        gids = group_ids if group_ids is not None else group_ids_for_range(base_group, 999)
         rid = create_rule_minimal(
             name=rule_name,
             policy=policy,
@@ -34,16 +38,29 @@ def ensure_rule_for_source(rule_name: str, policy: int, base_group: str,
         log.info("[RULE] created '%s' (ID %s) with %d groups", rule_name, rid, len(gids))
         return rid
     rid = int(rule["id"])
-    if rule["action"] != policy or \
-        rule["is_enabled"] is not rule_enabled:
-        update_rule_action(policy, rule, rule_enabled)
+    queue_rule_update(rule_name, policy=policy, enabled=rule_enabled)
     return rid
 
 
-def sync_rule_to_used(rule_name: str, base_group: str, used_count: int) -> None:
-    gids = group_ids_for_range(base_group, used_count)
+def sync_rule_to_used(rule_name: str, base_group: str, used_count: int,
+                      empty_indices: Iterable[int] = ()) -> None:
+    gids = group_ids_for_range(base_group, used_count, empty_indices)
     rule = get_rule_by_name(rule_name)
     if not rule:
         return
-    update_rule_ip_groups(rule, gids)
-    log.info("[RULE] '%s': set %d/%d groups", rule_name, len(gids), used_count)
\ No newline at end of file
+    queue_rule_update(rule_name, group_ids=gids)
+    log.info("[RULE] '%s': set %d/%d groups", rule_name, len(gids), used_count)
+
+
+def sync_rule_to_groups(rule_name: str, group_ids: List[int]) -> None:
+    rule = get_rule_by_name(rule_name)
+    if not rule:
+        return
+    queue_rule_update(rule_name, group_ids=group_ids)
+    log.info("[RULE] '%s': set %d groups", rule_name, len(group_ids))
+
+
+def flush_rules() -> None:
+    sent = flush_rule_updates()
+    if sent:
+        log.info("[RULE] %d rule update(s) sent", sent)
@@ -0,0 +1,94 @@
+from __future__ import annotations
+from typing import Any, Dict, Iterable, List, Set, Tuple
+
+from helpers import log
+from helpers.ipset import IPSet
+from helpers.snapshot import has_ip_snapshot, load_ip_snapshots
+
+SET_OPS = ("union", "difference", "intersection")
+
+# entries of the sources pushed in this run that other sources' 'sets'
+# refer to, so they are not read back from their snapshots
+_results: Dict[str, IPSet] = {}
+_wanted: Set[str] = set()
+
+
+def set_operations(cfg: Dict[str, Any]) -> List[Tuple[str, List[str]]]:
+    """
+    The source's 'sets' stage as (op, source names) steps, in order.
+    """
+    steps: List[Tuple[str, List[str]]] = []
+    for item in cfg.get("sets") or []:
+        op, names = next(iter(item.items())) if isinstance(item, dict) and len(item) == 1 else (None, None)
+        if op not in SET_OPS:
+            log.warning("sets: expected one of %s per step, got %r — ignored", ", ".join(SET_OPS), item)
+            continue
+        if isinstance(names, str):
+            names = [names]
+        steps.append((op, [str(n).strip() for n in names or [] if n and str(n).strip()]))
+    return steps
+
+
+def set_sources(cfg: Dict[str, Any]) -> Set[str]:
+    """
+    Results a 'sets' stage reads, including those of txt-scored levels;
+    'ipsum/l3' means level 3 of 'ipsum'.
+    """
+    names = {n for _, ns in set_operations(cfg) for n in ns}
+    for ld in cfg.get("levels") or []:
+        names |= {n for _, ns in set_operations(ld) for n in ns}
+    return names
+
+
+def want_results(names: Iterable[str]) -> None:
+    _wanted.update(names)
+
+
+def is_wanted(name: str) -> bool:
+    return name in _wanted
+
+
+def record_result(name: str, entries: IPSet) -> None:
+    """
+    Keep the final entries of a source for the rest of the run, if a
+    'sets' stage of another source refers to it.
+    """
+    if name in _wanted:
+        _results[name] = entries
+
+
+def source_result(name: str) -> IPSet:
+    """
+    Entries of a source from this run, else from its last snapshot.
+    """
+    s = _results.get(name)
+    if s is not None:
+        return s
+    if not has_ip_snapshot(name):
+        log.warning("sets: no entries of '%s' in this run and no snapshot — treated as empty", name)
+        return IPSet()
+    s = _results[name] = load_ip_snapshots([name])
+    return s
+
+
+def apply_set_operations(label: str, cfg: Dict[str, Any], entries: IPSet) -> IPSet:
+    """
+    Run the source's 'sets' stage on its entries; unchanged if it has none.
+    """
+    steps = set_operations(cfg)
+    if not steps:
+        return entries
+    cur = entries
+    before = len(cur)
+    for op, names in steps:
+        if op == "union":
+            for n in names:
+                cur = cur | source_result(n)
+        elif op == "difference":
+            for n in names:
+                cur = cur - source_result(n)
+        else:
+            for n in names:
+                cur = cur & source_result(n)
+    log.info("%s: sets → %d entries (from %d)", label, len(cur), before)
+    return cur
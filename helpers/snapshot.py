@@ -1,43 +1,222 @@
 from __future__ import annotations
+from array import array
 from pathlib import Path
-from typing import Iterable, Set, LiteralString, List
+from typing import Dict, Iterable, Iterator, Set, LiteralString, List, Optional, Tuple, Union
 import gzip
+import mmap
+import os
+import struct
+import sys
+
+from helpers.ipset import IPSet, IPSetBuilder
 
 SNAP_DIR = Path("persist/snapshots")
 SNAP_DIR.mkdir(parents=True, exist_ok=True)
 
+# Binary snapshot: header, then the IPSet arrays little-endian and 8-byte
+# aligned, so they can be mapped and searched in place:
+#   v4 keys  uint64[n4]   network << 6 | prefix length
+#   v6 hi    uint64[n6]
+#   v6 lo    uint64[n6]
+#   v6 plen  uint8[n6], zero-padded to 8 bytes
+#   other    UTF-8, newline-separated, other_len bytes
+_MAGIC = b"SLIPSET1"
+_HEADER = struct.Struct("<8sQQQ")
+_NATIVE = sys.byteorder == "little"
+
+# loaded snapshots of this run: path → ((inode, mtime_ns, size), set)
+_memo: Dict[Path, Tuple[Tuple[int, int, int], IPSet]] = {}
+
 
 def _snap_path(name: str) -> Path:
+    return SNAP_DIR / f"{name}.ips.bin"
+
+
+def _legacy_path(name: str) -> Path:
     return SNAP_DIR / f"{name}.ips.txt.gz"
 
 
-def save_ip_snapshot(name: str, ips: Iterable[str]) -> None:
+def _pad8(n: int) -> int:
+    return -n % 8
+
+
+def _le_bytes(a: array) -> bytes:
+    if _NATIVE:
+        return a.tobytes()
+    a = array(a.typecode, a)
+    a.byteswap()
+    return a.tobytes()
+
+
+def _write_ipset(p: Path, s: IPSet) -> None:
+    other = "\n".join(s.other).encode("utf-8")
+    tmp = p.with_name(p.name + ".part")
+    with open(tmp, "wb") as f:
+        f.write(_HEADER.pack(_MAGIC, len(s.v4), len(s.v6_plen), len(other)))
+        for a in (s.v4, s.v6_hi, s.v6_lo):
+            f.write(_le_bytes(array("Q", a)))
+        f.write(bytes(s.v6_plen))
+        f.write(b"\0" * _pad8(len(s.v6_plen)))
+        f.write(other)
+    os.replace(tmp, p)
+
+
+def _map_ipset(p: Path) -> IPSet:
+    with open(p, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, n4, n6, other_len = _HEADER.unpack_from(mm, 0)
+    if magic != _MAGIC:
+        raise ValueError(f"{p}: not an IP snapshot")
+    view = memoryview(mm)
+    off = _HEADER.size
+
+    def uint64s(n: int) -> Union[memoryview, array]:
+        nonlocal off
+        part = view[off:off + 8 * n]
+        off += 8 * n
+        if _NATIVE:
+            return part.cast("Q")
+        a = array("Q", part.tobytes())
+        a.byteswap()
+        return a
+
+    s = IPSet()
+    s.v4 = uint64s(n4)
+    s.v6_hi = uint64s(n6)
+    s.v6_lo = uint64s(n6)
+    s.v6_plen = view[off:off + n6]
+    off += n6 + _pad8(n6)
+    other = bytes(view[off:off + other_len]).decode("utf-8")
+    s.other = tuple(other.split("\n")) if other else ()
+    return s
+
+
+def save_ip_snapshot(name: str, ips: Union[IPSet, Iterable[str]]) -> None:
     p = _snap_path(name)
     p.parent.mkdir(parents=True, exist_ok=True)
-    with gzip.open(p, "wt", encoding="utf-8") as f:
-        for ip in ips:
-            if ip:
-                f.write(ip)
-                f.write("\n")
+    _write_ipset(p, ips if isinstance(ips, IPSet) else IPSet.from_strings(ip for ip in ips if ip))
+    _legacy_path(name).unlink(missing_ok=True)
 
 
-def load_ip_snapshot(name: str|List[LiteralString]) -> Set[str]:
+def has_ip_snapshot(name: str) -> bool:
+    return _snap_path(name).exists() or _legacy_path(name).exists()
+
+
+def snapshot_version(name: str) -> Optional[str]:
+    """
+    Changes whenever the snapshot is written; None if there is none.
+    """
+    for p in (_snap_path(name), _legacy_path(name)):
+        try:
+            st = p.stat()
+        except OSError:
+            continue
+        return f"{st.st_mtime_ns}:{st.st_size}"
+    return None
+
+
+def load_ipset(name: str) -> Optional[IPSet]:
+    """
+    The snapshot mapped read-only, memoized until the file changes. A
+    snapshot still in the old gzip text format is converted first.
+    """
     p = _snap_path(name)
     if not p.exists():
-        return set()
-    out: Set[str] = set()
-    with gzip.open(p, "rt", encoding="utf-8") as f:
-        for line in f:
-            ip = line.strip()
-            if ip:
-                out.add(ip)
+        if not _legacy_path(name).exists():
+            return None
+        import_ip_snapshot(name, _legacy_path(name))
+    st = p.stat()
+    key = (st.st_ino, st.st_mtime_ns, st.st_size)
+    hit = _memo.get(p)
+    if hit is not None and hit[0] == key:
+        return hit[1]
+    s = _map_ipset(p)
+    _memo[p] = (key, s)
+    return s
+
+
+def iter_ip_snapshot(name: str) -> Iterator[str]:
+    s = load_ipset(name)
+    if s is not None:
+        yield from s
+
+
+def load_ip_snapshot(name: str|List[LiteralString]) -> Set[str]:
+    return set(iter_ip_snapshot(name))
+
+
+def delete_ip_snapshot(name: str) -> None:
+    p = _snap_path(name)
+    _memo.pop(p, None)
+    p.unlink(missing_ok=True)
+    _legacy_path(name).unlink(missing_ok=True)
+
+
+def export_ip_snapshot(name: str, dest: Union[str, Path]) -> int:
+    """
+    Write the snapshot as gzip text, one entry per line (the old format).
+    """
+    n = 0
+    with gzip.open(dest, "wt", encoding="utf-8") as f:
+        for ip in iter_ip_snapshot(name):
+            f.write(ip)
+            f.write("\n")
+            n += 1
+    return n
+
+
+def import_ip_snapshot(name: str, src: Union[str, Path]) -> int:
+    """
+    Replace the snapshot with the entries of a gzip text file.
+    """
+    b = IPSetBuilder()
+    with gzip.open(src, "rt", encoding="utf-8") as f:
+        b.update(ip for ip in (line.strip() for line in f) if ip)
+    s = b.build()
+    save_ip_snapshot(name, s)
+    return len(s)
+
+
+# Group records: the contents last pushed to a SafeLine group, by group id.
+
+def save_group_record(gid: int, ips: Iterable[str]) -> None:
+    save_ip_snapshot(f"group-{gid}", ips)
+
+
+def load_group_record(gid: int) -> Optional[Set[str]]:
+    name = f"group-{gid}"
+    if not has_ip_snapshot(name):
+        return None
+    return load_ip_snapshot(name)
+
+
+def drop_group_record(gid: int) -> None:
+    delete_ip_snapshot(f"group-{gid}")
+
+
+def load_ip_snapshots(names: Iterable[str]) -> IPSet:
+    """
+    Union of the named snapshots, packed; no per-entry strings are kept.
+    A single snapshot is returned as mapped.
+    """
+    sets = [s for s in (load_ipset(n) for n in names) if s is not None]
+    if not sets:
+        return IPSet()
+    out = sets[0]
+    for s in sets[1:]:
+        out = out | s
     return out
 
 
-def load_ip_snapshots(names: Iterable[str]) -> Set[str]:
-    union: Set[str] = set()
-    for name in names:
-        s = load_ip_snapshot(name)
-        if s:
-            union |= s
-    return union
+if __name__ == "__main__":
+    import argparse
+
+    ap = argparse.ArgumentParser(description="Convert IP snapshots to and from gzip text.")
+    ap.add_argument("action", choices=["export", "import"])
+    ap.add_argument("name", help="snapshot name, e.g. abuseip or group-12")
+    ap.add_argument("file", help="gzip text file, one entry per line")
+    args = ap.parse_args()
+    if args.action == "export":
+        print(f"{export_ip_snapshot(args.name, args.file)} entries written to {args.file}")
+    else:
+        print(f"{import_ip_snapshot(args.name, args.file)} entries imported into {args.name}")
@@ -1,15 +1,38 @@
 from __future__ import annotations
-import requests
-from typing import List
+from typing import Any, Dict, Iterable, Iterator, Optional
 
+from helpers.fetch import fetch_raw
+from helpers.raw_cache import iter_raw_lines, last_processed
 
-def fetch_text_lines(url: str, timeout: int = 20) -> List[str]:
-    r = requests.get(url, timeout=timeout)
-    r.raise_for_status()
-    lines: List[str] = []
-    for raw in r.text.splitlines():
+
+def _clean_lines(lines: Iterable[str]) -> Iterator[str]:
+    for raw in lines:
         s = raw.strip()
         if not s or s.startswith("#"):
             continue
-        lines.append(s)
-    return lines
+        yield s
+
+
+def iter_text_lines(url: str, timeout: int = 20,
+                    state: Optional[Dict[str, Any]] = None) -> Optional[Iterator[str]]:
+    """
+    Streams the non-empty, non-comment lines of a text feed from the raw
+    cache, without holding the whole body in memory. With state, None
+    means not modified (304 or same payload as last run).
+    """
+    digest = fetch_raw(url, state, timeout=timeout)
+    if digest is None:
+        return None
+    return _clean_lines(iter_raw_lines(digest))
+
+
+def iter_last_text_lines(url: str, state: Dict[str, Any], timeout: int = 20) -> Iterator[str]:
+    """
+    Lines of the last processed payload of url, downloaded again only if
+    it is no longer cached.
+    """
+    digest = last_processed(state, url)
+    if digest is None:
+        return iter_text_lines(url, timeout) or iter(())
+    return _clean_lines(iter_raw_lines(digest))
+
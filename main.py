@@ -1,11 +1,19 @@
 from __future__ import annotations
 import argparse
-from typing import Dict, Any
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Any, Optional, Set
 
 from config.sources import SOURCES
 from helpers.state import load_state, save_state
-from helpers.parse_source import process_source
+from helpers.parse_source import fetch_source, push_source
+from helpers.rules_sync import flush_rules
+from helpers.pacing import load_pacing, store_pacing
+from helpers.fetch import set_replay
+from helpers.raw_cache import prune_raw_cache
+from helpers.cidr_index import exclusion_sources, resolved_conflicts
+from helpers.set_algebra import set_sources, want_results
 from helpers import log
+from config.credentials import settings
 
 KIND_ALL = "all"
 
@@ -21,9 +29,15 @@ def parse_args() -> argparse.Namespace:
     p.add_argument(
         "--kind",
         default=KIND_ALL,
-        choices=[KIND_ALL, "json-cidrs", "whois-radb", "abuseipdb", "txt-cidrs"],
+        choices=[KIND_ALL, "json-cidrs", "whois-radb", "abuseipdb", "txt-cidrs", "txt-scored", "combined"],
         help="Limit processing to a specific source kind."
     )
+    p.add_argument(
+        "--replay",
+        action="store_true",
+        help="Push again from the cached raw payloads of the last run without contacting upstreams "
+             "(e.g. after a SafeLine restore)."
+    )
     p.add_argument(
         "--dry-run",
         action="store_true",
@@ -32,17 +46,49 @@ def parse_args() -> argparse.Namespace:
     return p.parse_args()
 
 
+def _waits_for(cfg: Dict[str, Any]) -> Set[str]:
+    """
+    Sources that must be pushed first: 'exclude_from' and
+    'exclude_cidrs_from' read their snapshots, 'sets' their results.
+    """
+    deps = cfg.get("exclude_from") or []
+    if isinstance(deps, str):
+        deps = [deps]
+    deps = {str(d).strip() for d in deps if d and str(d).strip()} | set(exclusion_sources(cfg))
+    # 'ipsum/l3' is a level of source 'ipsum'
+    return deps | {n.split("/", 1)[0] for n in set_sources(cfg)}
+
+
+def _push(name: str, cfg: Dict[str, Any], state: Dict[str, Any], fetched: Optional[Dict[str, Any]]) -> bool:
+    log.info("=== [%s] kind=%s ===", name, cfg.get("kind"))
+    try:
+        push_source(name, cfg, state, fetched)
+        return True
+    except Exception as e:
+        log.error("%s: %s", name, e)
+        return False
+    finally:
+        try:
+            flush_rules()
+        except Exception as e:
+            log.error("%s: rule update failed: %s", name, e)
+
+
 def main() -> None:
     args = parse_args()
     state: Dict[str, Any] = load_state()
+    load_pacing(state)
 
     if args.dry_run:
         log.info("Dry-run enabled: no changes will be pushed.")
+    if args.replay:
+        set_replay(True)
+        log.info("Replay enabled: sources are read from persist/raw and pushed in full.")
 
     selected = set(args.only) if args.only else None
     processed = 0
 
-
+    jobs: Dict[str, Dict[str, Any]] = {}
     for name, cfg in SOURCES.items():
         if selected and name not in selected:
             continue
@@ -50,19 +96,61 @@ def main() -> None:
             continue
         if args.kind != KIND_ALL and cfg.get("kind") != args.kind:
             continue
+        jobs[name] = cfg
 
-        log.info("=== [%s] kind=%s ===", name, cfg.get("kind"))
-        try:
-            process_source(name, cfg, state)
+    for cfg in jobs.values():
+        want_results(set_sources(cfg))
+
+    # Fetch all sources in parallel and push each one as soon as it is ready
+    # (and the sources it excludes are pushed), so upstream waits overlap
+    # with SafeLine uploads. Pushes stay sequential on this thread.
+    ready: Dict[str, Optional[Dict[str, Any]]] = {}
+    done: Set[str] = set()
+
+    def push_ready() -> None:
+        nonlocal processed
+        for name in list(ready):
+            if (_waits_for(jobs[name]) & jobs.keys()) - done - {name}:
+                continue
+            if _push(name, jobs[name], state, ready.pop(name)):
+                processed += 1
+            done.add(name)
+
+    if jobs:
+        workers = max(1, min(settings.FETCH_CONCURRENCY, len(jobs)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fetch") as pool:
+            futures = {pool.submit(fetch_source, name, cfg, state): name for name, cfg in jobs.items()}
+            for fut in as_completed(futures):
+                name = futures[fut]
+                try:
+                    ready[name] = fut.result()
+                except Exception as e:
+                    log.error("%s: %s", name, e)
+                    done.add(name)
+                    continue
+                while ready:
+                    before = len(ready)
+                    push_ready()
+                    if len(ready) == before:
+                        break
+
+    # circular exclude_from / exclude_cidrs_from: push the rest in config order
+    for name in list(ready):
+        if _push(name, jobs[name], state, ready.pop(name)):
             processed += 1
-        except Exception as e:
-            log.error("%s: %s", name, e)
 
+    store_pacing(state)
+    try:
+        prune_raw_cache(state, settings.RAW_CACHE_MAX_MB * 1024 * 1024)
+    except OSError as e:
+        log.warning("raw cache cleanup failed: %s", e)
     save_state(state)
     if processed == 0:
         log.warning("No sources matched your filters. Check 'enabled', --only, or --kind.")
     else:
         log.info("Sources processed: %s", processed)
+    if resolved_conflicts():
+        log.info("exclude_cidrs_from: %d conflicts resolved", resolved_conflicts())
 
 
 if __name__ == "__main__":